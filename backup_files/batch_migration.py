@@ -4,294 +4,580 @@ Batch Migration Script - Process data in small batches to avoid timeouts
 """
 
 import argparse
+import contextlib
+import io
 import logging
 import sqlite3
-from psycopg2.extras import RealDictCursor
-from supabase_manager import SupabaseManager
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from config_manager import config
 
+try:
+    from pgcopy import CopyManager
+except ImportError:  # Optional: without pgcopy the numeric-heavy tables use text COPY
+    CopyManager = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+# (table, column, unique) indexes the set-based voucher joins rely on
+REQUIRED_INDEXES = (
+    ('vouchers', 'guid', True),
+    ('ledger_entries', 'voucher_id', False),
+    ('inventory_entries', 'voucher_id', False),
+)
+
+SQLITE_FETCH_SIZE = 1000  # Rows pulled from SQLite per fetchmany()
+
+class TableSpec:
+    """Describes how one SQLite table is staged and upserted into Supabase.
+    
+    staging_columns lists the SQLite SELECT columns followed by company_id and
+    division_id. A 'voucher_guid' column is resolved to voucher_id by joining
+    vouchers on the Supabase side. column_types enables binary COPY via pgcopy.
+    """
+    
+    def __init__(self, name, label, select_sql, staging_columns, update_columns, column_types=None):
+        self.name = name
+        self.label = label
+        self.select_sql = select_sql
+        self.staging_columns = staging_columns
+        self.update_columns = update_columns
+        self.column_types = column_types
+        self.staging_table = f'{name}_staging'
+        self.references_voucher = 'voucher_guid' in staging_columns
+        self.target_columns = tuple(
+            'voucher_id' if column == 'voucher_guid' else column for column in staging_columns
+        )
+        
+        target_list = ', '.join(self.target_columns)
+        self.conflict_clause = f'''
+            ON CONFLICT (guid) DO UPDATE SET
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in update_columns)}
+            WHERE ({', '.join(f'{name}.{column}' for column in update_columns)})
+                IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in update_columns)})
+        '''
+        self.upsert_sql = f"INSERT INTO {name} ({target_list}) VALUES %s" + self.conflict_clause
+        
+        if self.references_voucher:
+            staging_select = ', '.join(
+                'v.guid AS voucher_guid' if column == 'voucher_guid' else f't.{column}'
+                for column in staging_columns
+            )
+            staging_from = f'{name} t, vouchers v'
+            matched_select = ', '.join(
+                'v.id AS voucher_id' if column == 'voucher_guid' else f's.{column}'
+                for column in staging_columns
+            )
+            matched_from = f'{self.staging_table} s JOIN vouchers v ON v.guid = s.voucher_guid'
+        else:
+            staging_select = ', '.join(f't.{column}' for column in staging_columns)
+            staging_from = f'{name} t'
+            matched_select = ', '.join(f's.{column}' for column in staging_columns)
+            matched_from = f'{self.staging_table} s'
+        
+        self.create_staging_sql = f'''
+            CREATE TEMP TABLE {self.staging_table} ON COMMIT DROP AS
+            SELECT {staging_select} FROM {staging_from} WITH NO DATA
+        '''
+        # Insert only rows the target lacks and update only rows whose content differs,
+        # so an idempotent re-run writes nothing. Both see the same snapshot, so they
+        # never touch the same row; matched_count tells us how many child rows had no voucher.
+        self.merge_staging_sql = f'''
+            WITH matched AS (
+                SELECT {matched_select} FROM {matched_from}
+            ), inserted AS (
+                INSERT INTO {name} ({target_list})
+                SELECT m.* FROM matched m
+                LEFT JOIN {name} existing USING (guid)
+                WHERE existing.guid IS NULL
+                ON CONFLICT (guid) DO NOTHING
+                RETURNING 1
+            ), updated AS (
+                UPDATE {name} t SET
+                    {', '.join(f'{column} = m.{column}' for column in update_columns)}
+                FROM matched m
+                WHERE t.guid = m.guid
+                  AND ({', '.join(f't.{column}' for column in update_columns)})
+                      IS DISTINCT FROM ({', '.join(f'm.{column}' for column in update_columns)})
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM matched) AS matched_count,
+                   (SELECT COUNT(*) FROM inserted) AS inserted_count,
+                   (SELECT COUNT(*) FROM updated) AS updated_count
+        '''
+
+VOUCHERS = TableSpec(
+    name='vouchers',
+    label='voucher',
+    select_sql='''
+        SELECT guid, date, voucher_type, voucher_number, reference_number, 
+               reference_date, narration, party_name, place_of_supply,
+               is_invoice, is_accounting_voucher, is_inventory_voucher, is_order_voucher
+        FROM vouchers
+        WHERE rowid > ?
+        ORDER BY rowid
+        LIMIT ?
+    ''',
+    staging_columns=(
+        'guid', 'date', 'voucher_type', 'voucher_number', 'reference_number',
+        'reference_date', 'narration', 'party_name', 'place_of_supply',
+        'is_invoice', 'is_accounting_voucher', 'is_inventory_voucher', 'is_order_voucher',
+        'company_id', 'division_id'
+    ),
+    update_columns=(
+        'date', 'voucher_type', 'voucher_number', 'reference_number',
+        'reference_date', 'narration', 'party_name', 'place_of_supply',
+        'is_invoice', 'is_accounting_voucher', 'is_inventory_voucher', 'is_order_voucher'
+    )
+)
+
+LEDGER_ENTRIES = TableSpec(
+    name='ledger_entries',
+    label='ledger entry',
+    select_sql='''
+        SELECT le.guid, le.ledger_name, le.amount, le.is_debit, v.guid as voucher_guid
+        FROM ledger_entries le
+        JOIN vouchers v ON le.voucher_id = v.id
+        WHERE le.rowid > ?
+        ORDER BY le.rowid
+        LIMIT ?
+    ''',
+    staging_columns=('guid', 'ledger_name', 'amount', 'is_debit', 'voucher_guid', 'company_id', 'division_id'),
+    update_columns=('voucher_id', 'ledger_name', 'amount', 'is_debit'),
+    column_types=(str, str, Decimal, bool, str, str, str)
+)
+
+INVENTORY_ENTRIES = TableSpec(
+    name='inventory_entries',
+    label='inventory entry',
+    select_sql='''
+        SELECT ie.guid, ie.stock_item_name, ie.quantity, ie.rate, ie.amount, v.guid as voucher_guid
+        FROM inventory_entries ie
+        JOIN vouchers v ON ie.voucher_id = v.id
+        WHERE ie.rowid > ?
+        ORDER BY ie.rowid
+        LIMIT ?
+    ''',
+    staging_columns=(
+        'guid', 'stock_item_name', 'quantity', 'rate', 'amount', 'voucher_guid', 'company_id', 'division_id'
+    ),
+    update_columns=('voucher_id', 'stock_item_name', 'quantity', 'rate', 'amount'),
+    column_types=(str, str, Decimal, Decimal, Decimal, str, str, str)
+)
+
+def _format_copy_value(value):
+    """Format a value for COPY text format (NULL as \\N, escape tab/newline/backslash)."""
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+class _CopyStream(io.TextIOBase):
+    """File-like object that renders rows to COPY text format as psycopg2 reads it."""
+    
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+        self.row_count = 0
+    
+    def readable(self):
+        return True
+    
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += '\t'.join(_format_copy_value(value) for value in row) + '\n'
+            self.row_count += 1
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+def _copy_rows(cursor, table, columns, rows):
+    """Stream rows into a table with a single COPY FROM STDIN; returns the row count."""
+    stream = _CopyStream(rows)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream)
+    return stream.row_count
+
+def _to_binary_value(value, value_type):
+    """Coerce a SQLite value to the Python type pgcopy expects for its column."""
+    if value is None:
+        return None
+    if value_type is Decimal:
+        value = str(value).replace(',', '')
+        return Decimal(value) if value else None
+    return value_type(value)
+
+def _copy_rows_binary(cursor, table, columns, column_types, rows):
+    """COPY rows into a temp table using PostgreSQL's binary format via pgcopy.
+    
+    Falls back to text COPY when pgcopy is not installed. Returns the row count.
+    """
+    if CopyManager is None:
+        return _copy_rows(cursor, table, columns, rows)
+    
+    # pgcopy needs the schema; temp tables live in this session's pg_temp_N schema
+    cursor.execute('SELECT nspname FROM pg_namespace WHERE oid = pg_my_temp_schema()')
+    temp_schema, = cursor.fetchone()
+    row_count = 0
+    
+    def binary_rows():
+        nonlocal row_count
+        for row in rows:
+            row_count += 1
+            yield tuple(_to_binary_value(value, value_type) for value, value_type in zip(row, column_types))
+    
+    CopyManager(cursor.connection, f'{temp_schema}.{table}', columns).copy(binary_rows(), io.BytesIO)
+    return row_count
+
+def batch_starts(sqlite_conn, table, batch_size):
+    """Return the rowid each batch of `table` starts after, for keyset pagination.
+    
+    Shared with run_full_migration.py, which hands these to --after-rowid.
+    """
+    sqlite_cursor = sqlite_conn.cursor()
+    sqlite_cursor.execute(f'''
+        SELECT rowid FROM (
+            SELECT rowid, ROW_NUMBER() OVER (ORDER BY rowid) AS n FROM {table}
+        )
+        WHERE n % ? = 0 AND n < (SELECT COUNT(*) FROM {table})
+    ''', (batch_size,))
+    return [0] + [row[0] for row in sqlite_cursor]
+
+def _log_row_errors(message, errors):
+    """Log a batch's per-row failures as one summary line instead of one line per row."""
+    if not errors:
+        return
+    logger.warning(f"⚠️  {message}: {len(errors)} rows, first {min(len(errors), 5)}: {errors[:5]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        for error in errors[5:]:
+            logger.debug(f"   {error}")
+
+def _upsert_rows(cursor, query, rows, label):
+    """Upsert rows with execute_values, falling back to a prepared row-by-row upsert on failure.
+    
+    Returns a (success_count, error_count) tuple.
+    """
+    cursor.execute('SAVEPOINT upsert_batch')
+    try:
+        execute_values(cursor, query, rows, page_size=500)
+        cursor.execute('RELEASE SAVEPOINT upsert_batch')
+        return len(rows), 0
+    except psycopg2.Error as e:
+        cursor.execute('ROLLBACK TO SAVEPOINT upsert_batch')
+        logger.warning(f"⚠️  Bulk {label} upsert failed, retrying row by row: {e}")
+    
+    if not rows:
+        return 0, 0
+    
+    # Prepare the single-row upsert once so each retry skips parse/plan
+    statement = label.replace(' ', '_') + '_upsert'
+    placeholders = ', '.join(f'${i}' for i in range(1, len(rows[0]) + 1))
+    cursor.execute(f"PREPARE {statement} AS " + query.replace('VALUES %s', f'VALUES ({placeholders})'))
+    execute_sql = f"EXECUTE {statement} ({', '.join(['%s'] * len(rows[0]))})"
+    
+    success_count = 0
+    errors = []
+    try:
+        for row in rows:
+            cursor.execute('SAVEPOINT upsert_row')
+            try:
+                cursor.execute(execute_sql, row)
+                cursor.execute('RELEASE SAVEPOINT upsert_row')
+                success_count += 1
+            except psycopg2.Error as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT upsert_row')
+                errors.append((row[0], str(e).strip()))
+    finally:
+        cursor.execute(f"DEALLOCATE {statement}")
+    
+    _log_row_errors(f"Error inserting {label}", errors)
+    return success_count, len(errors)
+
+class MigrationConnection(psycopg2.extensions.connection):
+    """Connection that applies the per-session settings once, when it is opened."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocommit = False
+        with self.cursor() as cursor:
+            cursor.execute('SET search_path TO tally, public')
+        self.commit()
+
 class BatchMigration:
     def __init__(self):
-        self.supabase_manager = SupabaseManager()
         self.company_id = config.get_company_id()
         self.division_id = config.get_division_id()
         self.sqlite_db = 'tally_data.db'
         self.batch_size = 50  # Process 50 records at a time
+        self.workers = 4  # Batches migrated concurrently
+        self.pool = None
+        self._lock = threading.Lock()
+        self._sqlite_local = threading.local()
+        self._sqlite_conns = []
+        self._indexes_checked = False
         
-    def migrate_vouchers_batch(self, offset=0, limit=None):
-        """Migrate vouchers in batches."""
-        logger.info(f"🔄 Migrating vouchers batch (offset: {offset}, limit: {limit or 'all'})...")
-        
-        # Connect to SQLite
-        sqlite_conn = sqlite3.connect(self.sqlite_db)
-        sqlite_cursor = sqlite_conn.cursor()
-        
-        # Connect to Supabase
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
-            return False
-        
-        try:
-            supabase_cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            supabase_cursor.execute('SET search_path TO tally, public')
-            
-            # Get vouchers from SQLite with limit
-            if limit:
-                sqlite_cursor.execute('''
-                    SELECT guid, date, voucher_type, voucher_number, reference_number, 
-                           reference_date, narration, party_name, place_of_supply,
-                           is_invoice, is_accounting_voucher, is_inventory_voucher, is_order_voucher
-                    FROM vouchers
-                    LIMIT ? OFFSET ?
-                ''', (limit, offset))
-            else:
-                sqlite_cursor.execute('''
-                    SELECT guid, date, voucher_type, voucher_number, reference_number, 
-                           reference_date, narration, party_name, place_of_supply,
-                           is_invoice, is_accounting_voucher, is_inventory_voucher, is_order_voucher
-                    FROM vouchers
-                    LIMIT ? OFFSET ?
-                ''', (self.batch_size, offset))
-            
-            vouchers = sqlite_cursor.fetchall()
-            logger.info(f"📊 Processing {len(vouchers)} vouchers")
-            
-            success_count = 0
-            error_count = 0
-            
-            for voucher in vouchers:
+    def _ensure_connected(self):
+        """Create the Supabase connection pool once and reuse it across batches."""
+        with self._lock:
+            if self.pool is None:
                 try:
-                    supabase_cursor.execute('''
-                        INSERT INTO vouchers (
-                            guid, date, voucher_type, voucher_number, reference_number,
-                            reference_date, narration, party_name, place_of_supply,
-                            is_invoice, is_accounting_voucher, is_inventory_voucher, is_order_voucher,
-                            company_id, division_id
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (guid) DO UPDATE SET
-                            date = EXCLUDED.date,
-                            voucher_type = EXCLUDED.voucher_type,
-                            voucher_number = EXCLUDED.voucher_number,
-                            reference_number = EXCLUDED.reference_number,
-                            reference_date = EXCLUDED.reference_date,
-                            narration = EXCLUDED.narration,
-                            party_name = EXCLUDED.party_name,
-                            place_of_supply = EXCLUDED.place_of_supply,
-                            is_invoice = EXCLUDED.is_invoice,
-                            is_accounting_voucher = EXCLUDED.is_accounting_voucher,
-                            is_inventory_voucher = EXCLUDED.is_inventory_voucher,
-                            is_order_voucher = EXCLUDED.is_order_voucher
-                    ''', (
-                        voucher[0], voucher[1], voucher[2], voucher[3], voucher[4],
-                        voucher[5], voucher[6], voucher[7], voucher[8], voucher[9],
-                        voucher[10], voucher[11], voucher[12], self.company_id, self.division_id
-                    ))
-                    success_count += 1
-                        
+                    self.pool = ThreadedConnectionPool(
+                        1, self.workers, config.get_supabase_url(),
+                        connection_factory=MigrationConnection
+                    )
                 except Exception as e:
-                    error_count += 1
-                    logger.warning(f"⚠️  Error inserting voucher {voucher[0]}: {e}")
-            
-            self.supabase_manager.conn.commit()
-            logger.info(f"✅ Vouchers batch completed: {success_count} success, {error_count} errors")
+                    logger.error(f"❌ Failed to connect to Supabase: {e}")
+                    return False
             
+            if not self._indexes_checked:
+                self._ensure_indexes()
+                self._indexes_checked = True
+        
+        return True
+    
+    def _ensure_indexes(self):
+        """Make sure the columns used to join child rows to vouchers are indexed."""
+        supabase_conn = self.pool.getconn()
+        try:
+            cursor = supabase_conn.cursor()
+            for table, column, unique in REQUIRED_INDEXES:
+                cursor.execute('''
+                    SELECT 1 FROM pg_index i
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                    WHERE i.indrelid = %s::regclass AND a.attname = %s
+                    LIMIT 1
+                ''', (table, column))
+                if cursor.fetchone():
+                    continue
+                
+                logger.warning(f"⚠️  No index on {table}({column}), creating one")
+                cursor.execute(
+                    f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS "
+                    f"idx_{table}_{column} ON {table}({column})"
+                )
+            supabase_conn.commit()
         except Exception as e:
-            logger.error(f"❌ Error in voucher batch: {e}")
-            self.supabase_manager.conn.rollback()
+            logger.warning(f"⚠️  Could not verify indexes: {e}")
+            supabase_conn.rollback()
         finally:
-            sqlite_conn.close()
-            self.supabase_manager.disconnect()
-        
-        return success_count > 0
+            self.pool.putconn(supabase_conn)
     
-    def migrate_ledger_entries_batch(self, offset=0, limit=None):
-        """Migrate ledger entries in batches."""
-        logger.info(f"🔄 Migrating ledger entries batch (offset: {offset}, limit: {limit or 'all'})...")
-        
-        # Connect to SQLite
-        sqlite_conn = sqlite3.connect(self.sqlite_db)
-        sqlite_cursor = sqlite_conn.cursor()
+    def _get_sqlite_conn(self):
+        """Return this thread's SQLite connection, opening it on first use."""
+        sqlite_conn = getattr(self._sqlite_local, 'conn', None)
+        if sqlite_conn is None:
+            sqlite_conn = sqlite3.connect(self.sqlite_db, check_same_thread=False)
+            self._sqlite_local.conn = sqlite_conn
+            with self._lock:
+                self._sqlite_conns.append(sqlite_conn)
+        return sqlite_conn
+    
+    def close(self):
+        """Close the connections held for the migration run."""
+        with self._lock:
+            for sqlite_conn in self._sqlite_conns:
+                sqlite_conn.close()
+            self._sqlite_conns = []
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+        self._sqlite_local = threading.local()
+    
+    @contextlib.contextmanager
+    def bulk_load(self, tables):
+        """Drop secondary indexes and disable user triggers on `tables` for an initial load.
         
-        # Connect to Supabase
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
-            return False
+        Unique and primary key indexes are kept since the upserts rely on them.
+        Everything is restored and analyzed on exit, even if the load fails.
+        """
+        if not self._ensure_connected():
+            yield
+            return
         
+        supabase_conn = self.pool.getconn()
+        dropped_indexes = []
         try:
-            supabase_cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            supabase_cursor.execute('SET search_path TO tally, public')
-            
-            # Get ledger entries from SQLite with voucher GUID
-            if limit:
-                sqlite_cursor.execute('''
-                    SELECT le.guid, le.ledger_name, le.amount, le.is_debit, v.guid as voucher_guid
-                    FROM ledger_entries le
-                    JOIN vouchers v ON le.voucher_id = v.id
-                    LIMIT ? OFFSET ?
-                ''', (limit, offset))
-            else:
-                sqlite_cursor.execute('''
-                    SELECT le.guid, le.ledger_name, le.amount, le.is_debit, v.guid as voucher_guid
-                    FROM ledger_entries le
-                    JOIN vouchers v ON le.voucher_id = v.id
-                    LIMIT ? OFFSET ?
-                ''', (self.batch_size, offset))
-            
-            ledger_entries = sqlite_cursor.fetchall()
-            logger.info(f"📊 Processing {len(ledger_entries)} ledger entries")
-            
-            success_count = 0
-            error_count = 0
-            
-            for ledger_entry in ledger_entries:
-                try:
-                    # Get the Supabase voucher ID using the voucher GUID
-                    supabase_cursor.execute('SELECT id FROM vouchers WHERE guid = %s', (ledger_entry[4],))
-                    voucher_result = supabase_cursor.fetchone()
-                    
-                    if not voucher_result:
-                        logger.warning(f"⚠️  Voucher not found for GUID: {ledger_entry[4]}")
-                        error_count += 1
-                        continue
-                    
-                    voucher_id = voucher_result['id']
-                    
-                    supabase_cursor.execute('''
-                        INSERT INTO ledger_entries (
-                            guid, voucher_id, ledger_name, amount, is_debit,
-                            company_id, division_id
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (guid) DO UPDATE SET
-                            voucher_id = EXCLUDED.voucher_id,
-                            ledger_name = EXCLUDED.ledger_name,
-                            amount = EXCLUDED.amount,
-                            is_debit = EXCLUDED.is_debit
-                    ''', (
-                        ledger_entry[0], voucher_id, ledger_entry[1], ledger_entry[2], 
-                        ledger_entry[3], self.company_id, self.division_id
-                    ))
-                    success_count += 1
-                        
-                except Exception as e:
-                    error_count += 1
-                    logger.warning(f"⚠️  Error inserting ledger entry {ledger_entry[0]}: {e}")
-            
-            self.supabase_manager.conn.commit()
-            logger.info(f"✅ Ledger entries batch completed: {success_count} success, {error_count} errors")
-            
+            cursor = supabase_conn.cursor()
+            cursor.execute('''
+                SELECT n.nspname AS schema_name, c.relname AS index_name,
+                       pg_get_indexdef(i.indexrelid) AS definition
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE i.indrelid = ANY(%s::regclass[])
+                  AND NOT i.indisprimary AND NOT i.indisunique
+            ''', (list(tables),))
+            indexes = cursor.fetchall()  # (schema_name, index_name, definition)
+            for table in tables:
+                cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+            for schema_name, index_name, definition in indexes:
+                cursor.execute(f"DROP INDEX IF EXISTS {schema_name}.{index_name}")
+                dropped_indexes.append((index_name, definition))
+            supabase_conn.commit()
+            logger.info(f"🚀 Bulk mode: dropped {len(dropped_indexes)} indexes, disabled triggers on {', '.join(tables)}")
         except Exception as e:
-            logger.error(f"❌ Error in ledger entries batch: {e}")
-            self.supabase_manager.conn.rollback()
+            logger.warning(f"⚠️  Could not enter bulk mode: {e}")
+            supabase_conn.rollback()
+            dropped_indexes = []
         finally:
-            sqlite_conn.close()
-            self.supabase_manager.disconnect()
+            self.pool.putconn(supabase_conn)
         
-        return success_count > 0
+        try:
+            yield
+        finally:
+            supabase_conn = self.pool.getconn()
+            try:
+                cursor = supabase_conn.cursor()
+                for index_name, definition in dropped_indexes:
+                    logger.info(f"🔄 Recreating index {index_name}")
+                    cursor.execute(definition)
+                for table in tables:
+                    cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+                    cursor.execute(f"ANALYZE {table}")
+                supabase_conn.commit()
+                logger.info("✅ Bulk mode: indexes and triggers restored")
+            except Exception as e:
+                logger.error(f"❌ Failed to restore indexes/triggers, restore them manually: {e}")
+                supabase_conn.rollback()
+            finally:
+                self.pool.putconn(supabase_conn)
     
-    def migrate_inventory_entries_batch(self, offset=0, limit=None):
-        """Migrate inventory entries in batches."""
-        logger.info(f"🔄 Migrating inventory entries batch (offset: {offset}, limit: {limit or 'all'})...")
+    def _batch_starts(self, table):
+        """Return the rowid each batch of `table` starts after, for keyset pagination."""
+        return batch_starts(self._get_sqlite_conn(), table, self.batch_size)
+    
+    def run_batches(self, migrate_batch, table):
+        """Run migrate_batch over every batch of `table`, `workers` batches at a time."""
+        batch_starts = self._batch_starts(table)
+        logger.info(f"📦 Processing {len(batch_starts)} batches with {self.workers} workers")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(migrate_batch, batch_starts))
+    
+    def _fetch_rows(self, query, params):
+        """Stream SQLite rows in fetchmany() chunks, tagged with company and division."""
+        sqlite_cursor = self._get_sqlite_conn().cursor()
+        sqlite_cursor.arraysize = SQLITE_FETCH_SIZE
+        sqlite_cursor.execute(query, params)
+        for chunk in iter(sqlite_cursor.fetchmany, []):
+            for row in chunk:
+                yield row + (self.company_id, self.division_id)
+    
+    def _get_voucher_ids(self, cursor, voucher_guids):
+        """Map voucher GUIDs to Supabase voucher IDs with a single lookup."""
+        if not voucher_guids:
+            return {}
+        cursor.execute('SELECT guid, id FROM vouchers WHERE guid = ANY(%s)', (list(voucher_guids),))
+        return dict(cursor.fetchall())
+    
+    def _upsert_fallback(self, cursor, spec, rows):
+        """Row-isolating upsert used when the COPY path fails for a batch."""
+        missing_guids = []
+        if spec.references_voucher:
+            guid_index = spec.staging_columns.index('voucher_guid')
+            voucher_ids = self._get_voucher_ids(cursor, {row[guid_index] for row in rows})
+            resolved_rows = []
+            for row in rows:
+                voucher_id = voucher_ids.get(row[guid_index])
+                if not voucher_id:
+                    missing_guids.append(row[guid_index])
+                    continue
+                resolved_rows.append(row[:guid_index] + (voucher_id,) + row[guid_index + 1:])
+            _log_row_errors("Voucher not found for GUID", missing_guids)
+            rows = resolved_rows
         
-        # Connect to SQLite
-        sqlite_conn = sqlite3.connect(self.sqlite_db)
-        sqlite_cursor = sqlite_conn.cursor()
+        success_count, failed_count = _upsert_rows(cursor, spec.upsert_sql, rows, spec.label)
+        return success_count, len(missing_guids) + failed_count
+    
+    def _migrate_table(self, spec, after_rowid=0, limit=None):
+        """Migrate one keyset batch of a table described by `spec`."""
+        logger.info(f"🔄 Migrating {spec.name} batch (after rowid: {after_rowid}, limit: {limit or self.batch_size})...")
         
-        # Connect to Supabase
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
+        if not self._ensure_connected():
             return False
         
+        supabase_conn = self.pool.getconn()
+        
+        success_count = 0
         try:
-            supabase_cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            supabase_cursor.execute('SET search_path TO tally, public')
-            
-            # Get inventory entries from SQLite with voucher GUID
-            if limit:
-                sqlite_cursor.execute('''
-                    SELECT ie.guid, ie.stock_item_name, ie.quantity, ie.rate, ie.amount, v.guid as voucher_guid
-                    FROM inventory_entries ie
-                    JOIN vouchers v ON ie.voucher_id = v.id
-                    LIMIT ? OFFSET ?
-                ''', (limit, offset))
-            else:
-                sqlite_cursor.execute('''
-                    SELECT ie.guid, ie.stock_item_name, ie.quantity, ie.rate, ie.amount, v.guid as voucher_guid
-                    FROM inventory_entries ie
-                    JOIN vouchers v ON ie.voucher_id = v.id
-                    LIMIT ? OFFSET ?
-                ''', (self.batch_size, offset))
-            
-            inventory_entries = sqlite_cursor.fetchall()
-            logger.info(f"📊 Processing {len(inventory_entries)} inventory entries")
+            supabase_cursor = supabase_conn.cursor()
+            params = (after_rowid, limit or self.batch_size)
             
-            success_count = 0
-            error_count = 0
+            # Send the per-batch setup as one multi-statement round trip. A lost batch on
+            # crash is simply re-run, so skip the per-commit WAL flush.
+            supabase_cursor.execute(
+                'SET LOCAL synchronous_commit = off; SAVEPOINT staging_copy;' + spec.create_staging_sql
+            )
             
-            for inventory_entry in inventory_entries:
-                try:
-                    # Get the Supabase voucher ID using the voucher GUID
-                    supabase_cursor.execute('SELECT id FROM vouchers WHERE guid = %s', (inventory_entry[5],))
-                    voucher_result = supabase_cursor.fetchone()
-                    
-                    if not voucher_result:
-                        logger.warning(f"⚠️  Voucher not found for GUID: {inventory_entry[5]}")
-                        error_count += 1
-                        continue
-                    
-                    voucher_id = voucher_result['id']
-                    
-                    supabase_cursor.execute('''
-                        INSERT INTO inventory_entries (
-                            guid, voucher_id, stock_item_name, quantity, rate, amount,
-                            company_id, division_id
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (guid) DO UPDATE SET
-                            voucher_id = EXCLUDED.voucher_id,
-                            stock_item_name = EXCLUDED.stock_item_name,
-                            quantity = EXCLUDED.quantity,
-                            rate = EXCLUDED.rate,
-                            amount = EXCLUDED.amount
-                    ''', (
-                        inventory_entry[0], voucher_id, inventory_entry[1], inventory_entry[2],
-                        inventory_entry[3], inventory_entry[4], self.company_id, self.division_id
-                    ))
-                    success_count += 1
-                        
-                except Exception as e:
-                    error_count += 1
-                    logger.warning(f"⚠️  Error inserting inventory entry {inventory_entry[0]}: {e}")
+            # COPY the batch into staging, then upsert it (resolving voucher IDs) in one statement
+            try:
+                rows = self._fetch_rows(spec.select_sql, params)
+                if spec.column_types:
+                    staged_count = _copy_rows_binary(
+                        supabase_cursor, spec.staging_table, spec.staging_columns, spec.column_types, rows
+                    )
+                else:
+                    staged_count = _copy_rows(supabase_cursor, spec.staging_table, spec.staging_columns, rows)
+                logger.info(f"📊 Staged {staged_count} {spec.name}")
+                
+                supabase_cursor.execute(spec.merge_staging_sql)
+                success_count, inserted_count, updated_count = supabase_cursor.fetchone()
+                logger.info(f"📊 {inserted_count} new, {updated_count} changed {spec.name}")
+                error_count = staged_count - success_count
+                if error_count:
+                    logger.warning(f"⚠️  {error_count} {spec.name} skipped: voucher not found")
+            except (psycopg2.Error, ValueError, TypeError, ArithmeticError) as e:
+                # COPY is all-or-nothing; isolate the bad rows instead
+                supabase_cursor.execute('ROLLBACK TO SAVEPOINT staging_copy')
+                logger.warning(f"⚠️  COPY failed for {spec.name} batch, falling back: {e}")
+                rows = list(self._fetch_rows(spec.select_sql, params))
+                success_count, error_count = self._upsert_fallback(supabase_cursor, spec, rows)
             
-            self.supabase_manager.conn.commit()
-            logger.info(f"✅ Inventory entries batch completed: {success_count} success, {error_count} errors")
+            supabase_conn.commit()
+            logger.info(f"✅ {spec.name} batch completed: {success_count} success, {error_count} errors")
             
         except Exception as e:
-            logger.error(f"❌ Error in inventory entries batch: {e}")
-            self.supabase_manager.conn.rollback()
+            logger.error(f"❌ Error in {spec.name} batch: {e}")
+            supabase_conn.rollback()
         finally:
-            sqlite_conn.close()
-            self.supabase_manager.disconnect()
+            self.pool.putconn(supabase_conn)
         
         return success_count > 0
     
+    def migrate_vouchers_batch(self, after_rowid=0, limit=None):
+        """Migrate vouchers in batches."""
+        return self._migrate_table(VOUCHERS, after_rowid, limit)
+    
+    def migrate_ledger_entries_batch(self, after_rowid=0, limit=None):
+        """Migrate ledger entries in batches."""
+        return self._migrate_table(LEDGER_ENTRIES, after_rowid, limit)
+    
+    def migrate_inventory_entries_batch(self, after_rowid=0, limit=None):
+        """Migrate inventory entries in batches."""
+        return self._migrate_table(INVENTORY_ENTRIES, after_rowid, limit)
+    
     def get_total_counts(self):
         """Get total counts from SQLite."""
-        sqlite_conn = sqlite3.connect(self.sqlite_db)
-        sqlite_cursor = sqlite_conn.cursor()
-        
-        sqlite_cursor.execute('SELECT COUNT(*) FROM vouchers')
-        voucher_count = sqlite_cursor.fetchone()[0]
+        sqlite_cursor = self._get_sqlite_conn().cursor()
         
-        sqlite_cursor.execute('SELECT COUNT(*) FROM ledger_entries')
-        ledger_count = sqlite_cursor.fetchone()[0]
-        
-        sqlite_cursor.execute('SELECT COUNT(*) FROM inventory_entries')
-        inventory_count = sqlite_cursor.fetchone()[0]
-        
-        sqlite_conn.close()
+        sqlite_cursor.execute('''
+            SELECT (SELECT COUNT(*) FROM vouchers),
+                   (SELECT COUNT(*) FROM ledger_entries),
+                   (SELECT COUNT(*) FROM inventory_entries)
+        ''')
+        voucher_count, ledger_count, inventory_count = sqlite_cursor.fetchone()
         
         return voucher_count, ledger_count, inventory_count
 
@@ -299,45 +585,46 @@ def main():
     parser = argparse.ArgumentParser(description='Batch Migration Script')
     parser.add_argument('--action', choices=['vouchers', 'ledgers', 'inventory', 'all'], 
                        default='all', help='Action to perform')
-    parser.add_argument('--offset', type=int, default=0, help='Starting offset')
+    parser.add_argument('--after-rowid', type=int, default=0, help='Start after this SQLite rowid')
     parser.add_argument('--limit', type=int, help='Number of records to process')
     parser.add_argument('--batch-size', type=int, default=50, help='Batch size')
+    parser.add_argument('--workers', type=int, default=4, help='Number of batches to run concurrently')
+    parser.add_argument('--bulk-mode', action='store_true',
+                       help='Drop secondary indexes and disable triggers during --action all, rebuilding them afterwards')
     
     args = parser.parse_args()
     
     migration = BatchMigration()
     migration.batch_size = args.batch_size
+    migration.workers = args.workers
     
-    if args.action == 'vouchers':
-        migration.migrate_vouchers_batch(args.offset, args.limit)
-    elif args.action == 'ledgers':
-        migration.migrate_ledger_entries_batch(args.offset, args.limit)
-    elif args.action == 'inventory':
-        migration.migrate_inventory_entries_batch(args.offset, args.limit)
-    elif args.action == 'all':
-        # Get total counts
-        voucher_count, ledger_count, inventory_count = migration.get_total_counts()
-        logger.info(f"📊 Total records: {voucher_count} vouchers, {ledger_count} ledger entries, {inventory_count} inventory entries")
-        
-        # Process vouchers in batches
-        logger.info("🚀 Starting voucher migration...")
-        for offset in range(0, voucher_count, migration.batch_size):
-            logger.info(f"📦 Processing voucher batch {offset//migration.batch_size + 1}")
-            migration.migrate_vouchers_batch(offset)
-        
-        # Process ledger entries in batches
-        logger.info("🚀 Starting ledger entries migration...")
-        for offset in range(0, ledger_count, migration.batch_size):
-            logger.info(f"📦 Processing ledger batch {offset//migration.batch_size + 1}")
-            migration.migrate_ledger_entries_batch(offset)
-        
-        # Process inventory entries in batches
-        logger.info("🚀 Starting inventory entries migration...")
-        for offset in range(0, inventory_count, migration.batch_size):
-            logger.info(f"📦 Processing inventory batch {offset//migration.batch_size + 1}")
-            migration.migrate_inventory_entries_batch(offset)
-        
-        logger.info("✅ All batch migrations completed!")
+    with contextlib.closing(migration):
+        if args.action == 'vouchers':
+            migration.migrate_vouchers_batch(args.after_rowid, args.limit)
+        elif args.action == 'ledgers':
+            migration.migrate_ledger_entries_batch(args.after_rowid, args.limit)
+        elif args.action == 'inventory':
+            migration.migrate_inventory_entries_batch(args.after_rowid, args.limit)
+        elif args.action == 'all':
+            # Get total counts
+            voucher_count, ledger_count, inventory_count = migration.get_total_counts()
+            logger.info(f"📊 Total records: {voucher_count} vouchers, {ledger_count} ledger entries, {inventory_count} inventory entries")
+            
+            tables = (VOUCHERS.name, LEDGER_ENTRIES.name, INVENTORY_ENTRIES.name)
+            with migration.bulk_load(tables) if args.bulk_mode else contextlib.nullcontext():
+                # Process vouchers in batches
+                logger.info("🚀 Starting voucher migration...")
+                migration.run_batches(migration.migrate_vouchers_batch, 'vouchers')
+                
+                # Process ledger entries in batches
+                logger.info("🚀 Starting ledger entries migration...")
+                migration.run_batches(migration.migrate_ledger_entries_batch, 'ledger_entries')
+                
+                # Process inventory entries in batches
+                logger.info("🚀 Starting inventory entries migration...")
+                migration.run_batches(migration.migrate_inventory_entries_batch, 'inventory_entries')
+            
+            logger.info("✅ All batch migrations completed!")
 
 if __name__ == "__main__":
     main()
@@ -4,377 +4,618 @@ Data Quality Analysis for Supabase Tables
 Analyze data quality, relationships, and integrity of migrated data
 """
 
+import argparse
+import contextlib
+import csv
+import io
 import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
-from supabase_manager import SupabaseManager
+from psycopg2.pool import ThreadedConnectionPool
 from config_manager import config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+# Indexes supporting the analyzer's joins and aggregates: name -> (table, index definition)
+ANALYSIS_INDEXES = {
+    # Covering indexes let the relationship and sample joins probe by voucher_id index-only
+    'idx_ledger_entries_voucher_id_amount': ('ledger_entries', '(voucher_id) INCLUDE (amount)'),
+    'idx_inventory_entries_voucher_id_covering': (
+        'inventory_entries', '(voucher_id) INCLUDE (stock_item_name, quantity, rate, amount)'
+    ),
+    'idx_ledger_entries_ledger_name': ('ledger_entries', '(ledger_name)'),
+    'idx_inventory_entries_stock_item_name': ('inventory_entries', '(stock_item_name)'),
+    'idx_vouchers_voucher_type': ('vouchers', '(voucher_type)'),
+    # Vouchers are appended roughly in date order, which suits a tiny BRIN index
+    'idx_vouchers_date_brin': ('vouchers', 'USING brin (date)'),
+}
+
+# Materialized views backing the top-N distributions in analyze_data_patterns:
+# name -> (source table, grouping column, defining query). ensure_pattern_views() creates them
+# and refreshes stale ones; analyze_data_patterns runs the defining query directly if one is missing.
+PATTERN_VIEWS = {
+    'mv_voucher_type_counts': ('vouchers', 'voucher_type', '''
+        SELECT voucher_type, COUNT(*) as count
+        FROM vouchers
+        WHERE voucher_type IS NOT NULL
+        GROUP BY voucher_type
+    '''),
+    'mv_ledger_name_counts': ('ledger_entries', 'ledger_name', '''
+        SELECT ledger_name, COUNT(*) as count
+        FROM ledger_entries
+        WHERE ledger_name IS NOT NULL AND ledger_name != ''
+        GROUP BY ledger_name
+    '''),
+    'mv_stock_item_name_counts': ('inventory_entries', 'stock_item_name', '''
+        SELECT stock_item_name, COUNT(*) as count
+        FROM inventory_entries
+        WHERE stock_item_name IS NOT NULL AND stock_item_name != ''
+        GROUP BY stock_item_name
+    '''),
+}
+
 class DataQualityAnalysis:
     def __init__(self):
-        self.supabase_manager = SupabaseManager()
         self.company_id = config.get_company_id()
         self.division_id = config.get_division_id()
+        self.pool = None
+        self._lock = threading.Lock()
+    
+    def _getconn(self):
+        """Borrow a connection from the pool, creating the pool on first use."""
+        try:
+            with self._lock:
+                if self.pool is None:
+                    # search_path is a connection default, so analyzers need not set it per call
+                    self.pool = ThreadedConnectionPool(
+                        1, 4, config.get_supabase_url(), options='-c search_path=tally,public'
+                    )
+            return self.pool.getconn()
+        except Exception as e:
+            logger.error(f"❌ Failed to connect to Supabase: {e}")
+            return None
+    
+    @contextlib.contextmanager
+    def _cursor(self):
+        """Yield a RealDictCursor on a pooled connection, ending its read-only transaction afterwards."""
+        supabase_conn = self._getconn()
+        if supabase_conn is None:
+            raise RuntimeError("no Supabase connection available")
         
-    def analyze_table_counts(self):
-        """Analyze record counts in all tables."""
-        logger.info("📊 Analyzing table counts...")
-        
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
+        try:
+            yield supabase_conn.cursor(cursor_factory=RealDictCursor)
+        finally:
+            supabase_conn.rollback()
+            self.pool.putconn(supabase_conn)
+    
+    def close(self):
+        """Close the pooled connections."""
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+    
+    def _invalid_indexes(self, cursor):
+        """Return the ANALYSIS_INDEXES whose pg_index entry is marked not valid."""
+        cursor.execute('''
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indexrelid IN (SELECT to_regclass(name) FROM unnest(%s::text[]) AS name)
+              AND NOT i.indisvalid
+        ''', (list(ANALYSIS_INDEXES),))
+        return [row[0] for row in cursor.fetchall()]
+    
+    def ensure_indexes(self):
+        """Create the ANALYSIS_INDEXES that are missing, without blocking writers."""
+        supabase_conn = self._getconn()
+        if supabase_conn is None:
             return
         
+        create_sql = {
+            name: f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}'
+            for name, (table, definition) in ANALYSIS_INDEXES.items()
+        }
+        
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        supabase_conn.autocommit = True
         try:
-            cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute('SET search_path TO tally, public')
+            cursor = supabase_conn.cursor()
+            for sql in create_sql.values():
+                cursor.execute(sql)
             
-            tables = ['vouchers', 'ledger_entries', 'inventory_entries']
-            
-            for table in tables:
-                cursor.execute(f'SELECT COUNT(*) as count FROM {table}')
-                result = cursor.fetchone()
-                count = result['count'] if result else 0
-                logger.info(f"  📋 {table}: {count:,} records")
+            # A failed or cancelled concurrent build leaves an INVALID index behind, which
+            # IF NOT EXISTS then skips on every later run; drop and rebuild those
+            for name in self._invalid_indexes(cursor):
+                logger.warning(f"⚠️  Rebuilding invalid index {name}")
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+                cursor.execute(create_sql[name])
             
+            invalid = self._invalid_indexes(cursor)
+            if invalid:
+                logger.warning(f"⚠️  Analysis indexes still invalid: {', '.join(invalid)}")
+            else:
+                logger.info(f"✅ Verified {len(ANALYSIS_INDEXES)} analysis indexes")
         except Exception as e:
-            logger.error(f"❌ Error analyzing table counts: {e}")
+            logger.warning(f"⚠️  Could not create analysis indexes: {e}")
         finally:
-            self.supabase_manager.disconnect()
+            supabase_conn.autocommit = False
+            self.pool.putconn(supabase_conn)
+    
+    def analyze_table_counts(self, exact=False):
+        """Analyze record counts in all tables.
+        
+        Counts are planner estimates from pg_class unless `exact` is set; tables
+        that have never been analyzed are always counted exactly.
+        """
+        logger.info("📊 Analyzing table counts...")
+        
+        try:
+            with self._cursor() as cursor:
+                tables = ['vouchers', 'ledger_entries', 'inventory_entries']
+                
+                estimates = {}
+                if not exact:
+                    cursor.execute('''
+                        SELECT relname, reltuples::bigint as count
+                        FROM pg_class
+                        WHERE oid = ANY(%s::regclass[])
+                    ''', (tables,))
+                    estimates = {row['relname']: row['count'] for row in cursor.fetchall() if row['count'] >= 0}
+                
+                # Count the remaining tables exactly, in a single round trip
+                counted = [table for table in tables if table not in estimates]
+                counts = {}
+                if counted:
+                    cursor.execute('SELECT ' + ', '.join(f'(SELECT COUNT(*) FROM {table}) as {table}' for table in counted))
+                    counts = cursor.fetchone()
+                
+                for table in tables:
+                    if table in estimates:
+                        logger.info(f"  📋 {table}: ~{estimates[table]:,} records (estimated)")
+                    else:
+                        logger.info(f"  📋 {table}: {counts[table]:,} records")
+                
+        except Exception as e:
+            logger.error(f"❌ Error analyzing table counts: {e}")
+    
+    def _log_duplicate_guids(self, duplicate_count, duplicates):
+        """Log the duplicate GUID count and the sample of up to 5 returned by a summary query."""
+        if duplicate_count:
+            logger.warning(f"  ⚠️  Found {duplicate_count} duplicate GUIDs")
+            for dup in duplicates:
+                logger.warning(f"    GUID {dup['guid']}: {dup['count']} occurrences")
+        else:
+            logger.info("  ✅ No duplicate GUIDs found")
+    
+    def _duplicate_guids_sql(self, cursor, tables):
+        """Return, per table, the query listing duplicate GUIDs.
+        
+        A table with a single-column unique index on guid cannot hold duplicates,
+        so its query is a constant empty result instead of a full GROUP BY.
+        """
+        cursor.execute('''
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indrelid = ANY(%s::regclass[])
+              AND i.indisunique AND i.indnatts = 1 AND i.indpred IS NULL
+              AND a.attname = 'guid'
+        ''', (tables,))
+        unique_tables = {row['relname'] for row in cursor.fetchall()}
+        
+        return {
+            table: 'SELECT NULL::text as guid, 0 as count WHERE false' if table in unique_tables
+            else f'SELECT guid, COUNT(*) as count FROM {table} GROUP BY guid HAVING COUNT(*) > 1'
+            for table in tables
+        }
     
     def analyze_data_quality(self):
         """Analyze data quality issues."""
         logger.info("🔍 Analyzing data quality...")
         
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
-            return
-        
         try:
-            cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute('SET search_path TO tally, public')
-            
-            # Analyze vouchers
-            logger.info("📋 VOUCHERS ANALYSIS:")
-            
-            # Check for NULL values in critical fields
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(guid) as guid_count,
-                    COUNT(date) as date_count,
-                    COUNT(voucher_type) as voucher_type_count,
-                    COUNT(voucher_number) as voucher_number_count,
-                    COUNT(narration) as narration_count
-                FROM vouchers
-            ''')
-            result = cursor.fetchone()
-            logger.info(f"  Total vouchers: {result['total']:,}")
-            logger.info(f"  GUIDs: {result['guid_count']:,} ({result['guid_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Dates: {result['date_count']:,} ({result['date_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Voucher Types: {result['voucher_type_count']:,} ({result['voucher_type_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Voucher Numbers: {result['voucher_number_count']:,} ({result['voucher_number_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Narrations: {result['narration_count']:,} ({result['narration_count']/result['total']*100:.1f}%)")
-            
-            # Check for duplicate GUIDs
-            cursor.execute('''
-                SELECT guid, COUNT(*) as count 
-                FROM vouchers 
-                GROUP BY guid 
-                HAVING COUNT(*) > 1
-            ''')
-            duplicates = cursor.fetchall()
-            if duplicates:
-                logger.warning(f"  ⚠️  Found {len(duplicates)} duplicate GUIDs")
-                for dup in duplicates[:5]:  # Show first 5
-                    logger.warning(f"    GUID {dup['guid']}: {dup['count']} occurrences")
-            else:
-                logger.info("  ✅ No duplicate GUIDs found")
-            
-            # Analyze ledger entries
-            logger.info("\n📋 LEDGER ENTRIES ANALYSIS:")
-            
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(guid) as guid_count,
-                    COUNT(voucher_id) as voucher_id_count,
-                    COUNT(ledger_name) as ledger_name_count,
-                    COUNT(amount) as amount_count
-                FROM ledger_entries
-            ''')
-            result = cursor.fetchone()
-            logger.info(f"  Total ledger entries: {result['total']:,}")
-            logger.info(f"  GUIDs: {result['guid_count']:,} ({result['guid_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Voucher IDs: {result['voucher_id_count']:,} ({result['voucher_id_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Ledger Names: {result['ledger_name_count']:,} ({result['ledger_name_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Amounts: {result['amount_count']:,} ({result['amount_count']/result['total']*100:.1f}%)")
-            
-            # Analyze inventory entries
-            logger.info("\n📋 INVENTORY ENTRIES ANALYSIS:")
-            
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(guid) as guid_count,
-                    COUNT(voucher_id) as voucher_id_count,
-                    COUNT(stock_item_name) as stock_item_name_count,
-                    COUNT(quantity) as quantity_count,
-                    COUNT(rate) as rate_count,
-                    COUNT(amount) as amount_count
-                FROM inventory_entries
-            ''')
-            result = cursor.fetchone()
-            logger.info(f"  Total inventory entries: {result['total']:,}")
-            logger.info(f"  GUIDs: {result['guid_count']:,} ({result['guid_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Voucher IDs: {result['voucher_id_count']:,} ({result['voucher_id_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Stock Item Names: {result['stock_item_name_count']:,} ({result['stock_item_name_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Quantities: {result['quantity_count']:,} ({result['quantity_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Rates: {result['rate_count']:,} ({result['rate_count']/result['total']*100:.1f}%)")
-            logger.info(f"  Amounts: {result['amount_count']:,} ({result['amount_count']/result['total']*100:.1f}%)")
-            
+            with self._cursor() as cursor:
+                duplicates_sql = self._duplicate_guids_sql(cursor, ['vouchers', 'ledger_entries', 'inventory_entries'])
+                
+                # Analyze vouchers
+                logger.info("📋 VOUCHERS ANALYSIS:")
+                
+                # Check for NULL values in critical fields and duplicate GUIDs in one statement
+                cursor.execute(f'''
+                    WITH summary AS (
+                        SELECT 
+                            COUNT(*) as total,
+                            COUNT(guid) as guid_count,
+                            COUNT(date) as date_count,
+                            COUNT(voucher_type) as voucher_type_count,
+                            COUNT(voucher_number) as voucher_number_count,
+                            COUNT(narration) as narration_count
+                        FROM vouchers
+                    ), duplicates AS (
+                        {duplicates_sql['vouchers']}
+                    )
+                    SELECT summary.*,
+                           (SELECT COUNT(*) FROM duplicates) as duplicate_count,
+                           (SELECT json_agg(sample) FROM (SELECT * FROM duplicates LIMIT 5) sample) as duplicates
+                    FROM summary
+                ''')
+                result = cursor.fetchone()
+                logger.info(f"  Total vouchers: {result['total']:,}")
+                logger.info(f"  GUIDs: {result['guid_count']:,} ({result['guid_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Dates: {result['date_count']:,} ({result['date_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Voucher Types: {result['voucher_type_count']:,} ({result['voucher_type_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Voucher Numbers: {result['voucher_number_count']:,} ({result['voucher_number_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Narrations: {result['narration_count']:,} ({result['narration_count']/result['total']*100:.1f}%)")
+                self._log_duplicate_guids(result['duplicate_count'], result['duplicates'])
+                
+                # Analyze ledger entries
+                logger.info("\n📋 LEDGER ENTRIES ANALYSIS:")
+                
+                cursor.execute(f'''
+                    WITH summary AS (
+                        SELECT 
+                            COUNT(*) as total,
+                            COUNT(guid) as guid_count,
+                            COUNT(voucher_id) as voucher_id_count,
+                            COUNT(ledger_name) as ledger_name_count,
+                            COUNT(amount) as amount_count
+                        FROM ledger_entries
+                    ), duplicates AS (
+                        {duplicates_sql['ledger_entries']}
+                    )
+                    SELECT summary.*,
+                           (SELECT COUNT(*) FROM duplicates) as duplicate_count,
+                           (SELECT json_agg(sample) FROM (SELECT * FROM duplicates LIMIT 5) sample) as duplicates
+                    FROM summary
+                ''')
+                result = cursor.fetchone()
+                logger.info(f"  Total ledger entries: {result['total']:,}")
+                logger.info(f"  GUIDs: {result['guid_count']:,} ({result['guid_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Voucher IDs: {result['voucher_id_count']:,} ({result['voucher_id_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Ledger Names: {result['ledger_name_count']:,} ({result['ledger_name_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Amounts: {result['amount_count']:,} ({result['amount_count']/result['total']*100:.1f}%)")
+                self._log_duplicate_guids(result['duplicate_count'], result['duplicates'])
+                
+                # Analyze inventory entries
+                logger.info("\n📋 INVENTORY ENTRIES ANALYSIS:")
+                
+                cursor.execute(f'''
+                    WITH summary AS (
+                        SELECT 
+                            COUNT(*) as total,
+                            COUNT(guid) as guid_count,
+                            COUNT(voucher_id) as voucher_id_count,
+                            COUNT(stock_item_name) as stock_item_name_count,
+                            COUNT(quantity) as quantity_count,
+                            COUNT(rate) as rate_count,
+                            COUNT(amount) as amount_count
+                        FROM inventory_entries
+                    ), duplicates AS (
+                        {duplicates_sql['inventory_entries']}
+                    )
+                    SELECT summary.*,
+                           (SELECT COUNT(*) FROM duplicates) as duplicate_count,
+                           (SELECT json_agg(sample) FROM (SELECT * FROM duplicates LIMIT 5) sample) as duplicates
+                    FROM summary
+                ''')
+                result = cursor.fetchone()
+                logger.info(f"  Total inventory entries: {result['total']:,}")
+                logger.info(f"  GUIDs: {result['guid_count']:,} ({result['guid_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Voucher IDs: {result['voucher_id_count']:,} ({result['voucher_id_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Stock Item Names: {result['stock_item_name_count']:,} ({result['stock_item_name_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Quantities: {result['quantity_count']:,} ({result['quantity_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Rates: {result['rate_count']:,} ({result['rate_count']/result['total']*100:.1f}%)")
+                logger.info(f"  Amounts: {result['amount_count']:,} ({result['amount_count']/result['total']*100:.1f}%)")
+                self._log_duplicate_guids(result['duplicate_count'], result['duplicates'])
+                
         except Exception as e:
             logger.error(f"❌ Error analyzing data quality: {e}")
-        finally:
-            self.supabase_manager.disconnect()
     
     def analyze_relationships(self):
         """Analyze foreign key relationships."""
         logger.info("🔗 Analyzing relationships...")
         
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
-            return
-        
         try:
-            cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute('SET search_path TO tally, public')
-            
-            # Check voucher_id relationships in ledger_entries
-            logger.info("📋 LEDGER ENTRIES RELATIONSHIPS:")
-            
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_ledger_entries,
-                    COUNT(voucher_id) as entries_with_voucher_id,
-                    COUNT(CASE WHEN v.id IS NOT NULL THEN 1 END) as valid_voucher_relationships
-                FROM ledger_entries le
-                LEFT JOIN vouchers v ON le.voucher_id = v.id
-            ''')
-            result = cursor.fetchone()
-            logger.info(f"  Total ledger entries: {result['total_ledger_entries']:,}")
-            logger.info(f"  Entries with voucher_id: {result['entries_with_voucher_id']:,}")
-            logger.info(f"  Valid voucher relationships: {result['valid_voucher_relationships']:,}")
-            
-            if result['entries_with_voucher_id'] > 0:
-                relationship_percentage = (result['valid_voucher_relationships'] / result['entries_with_voucher_id']) * 100
-                logger.info(f"  Relationship integrity: {relationship_percentage:.1f}%")
-            
-            # Check voucher_id relationships in inventory_entries
-            logger.info("\n📋 INVENTORY ENTRIES RELATIONSHIPS:")
-            
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_inventory_entries,
-                    COUNT(voucher_id) as entries_with_voucher_id,
-                    COUNT(CASE WHEN v.id IS NOT NULL THEN 1 END) as valid_voucher_relationships
-                FROM inventory_entries ie
-                LEFT JOIN vouchers v ON ie.voucher_id = v.id
-            ''')
-            result = cursor.fetchone()
-            logger.info(f"  Total inventory entries: {result['total_inventory_entries']:,}")
-            logger.info(f"  Entries with voucher_id: {result['entries_with_voucher_id']:,}")
-            logger.info(f"  Valid voucher relationships: {result['valid_voucher_relationships']:,}")
-            
-            if result['entries_with_voucher_id'] > 0:
-                relationship_percentage = (result['valid_voucher_relationships'] / result['entries_with_voucher_id']) * 100
-                logger.info(f"  Relationship integrity: {relationship_percentage:.1f}%")
-            
-            # Check for orphaned records
-            logger.info("\n📋 ORPHANED RECORDS ANALYSIS:")
-            
-            cursor.execute('''
-                SELECT COUNT(*) as orphaned_ledger_entries
-                FROM ledger_entries le
-                LEFT JOIN vouchers v ON le.voucher_id = v.id
-                WHERE v.id IS NULL AND le.voucher_id IS NOT NULL
-            ''')
-            result = cursor.fetchone()
-            logger.info(f"  Orphaned ledger entries: {result['orphaned_ledger_entries']:,}")
-            
-            cursor.execute('''
-                SELECT COUNT(*) as orphaned_inventory_entries
-                FROM inventory_entries ie
-                LEFT JOIN vouchers v ON ie.voucher_id = v.id
-                WHERE v.id IS NULL AND ie.voucher_id IS NOT NULL
-            ''')
-            result = cursor.fetchone()
-            logger.info(f"  Orphaned inventory entries: {result['orphaned_inventory_entries']:,}")
-            
+            with self._cursor() as cursor:
+                # Check voucher_id relationships in ledger_entries
+                logger.info("📋 LEDGER ENTRIES RELATIONSHIPS:")
+                
+                cursor.execute('''
+                    SELECT 
+                        COUNT(*) as total_ledger_entries,
+                        COUNT(voucher_id) as entries_with_voucher_id,
+                        COUNT(v.id) as valid_voucher_relationships
+                    FROM ledger_entries le
+                    LEFT JOIN vouchers v ON le.voucher_id = v.id
+                ''')
+                result = cursor.fetchone()
+                # Every entry with a voucher_id either matches a voucher or is orphaned
+                orphaned_ledger_entries = result['entries_with_voucher_id'] - result['valid_voucher_relationships']
+                logger.info(f"  Total ledger entries: {result['total_ledger_entries']:,}")
+                logger.info(f"  Entries with voucher_id: {result['entries_with_voucher_id']:,}")
+                logger.info(f"  Valid voucher relationships: {result['valid_voucher_relationships']:,}")
+                
+                if result['entries_with_voucher_id'] > 0:
+                    relationship_percentage = (result['valid_voucher_relationships'] / result['entries_with_voucher_id']) * 100
+                    logger.info(f"  Relationship integrity: {relationship_percentage:.1f}%")
+                
+                # Check voucher_id relationships in inventory_entries
+                logger.info("\n📋 INVENTORY ENTRIES RELATIONSHIPS:")
+                
+                cursor.execute('''
+                    SELECT 
+                        COUNT(*) as total_inventory_entries,
+                        COUNT(voucher_id) as entries_with_voucher_id,
+                        COUNT(v.id) as valid_voucher_relationships
+                    FROM inventory_entries ie
+                    LEFT JOIN vouchers v ON ie.voucher_id = v.id
+                ''')
+                result = cursor.fetchone()
+                # Every entry with a voucher_id either matches a voucher or is orphaned
+                orphaned_inventory_entries = result['entries_with_voucher_id'] - result['valid_voucher_relationships']
+                logger.info(f"  Total inventory entries: {result['total_inventory_entries']:,}")
+                logger.info(f"  Entries with voucher_id: {result['entries_with_voucher_id']:,}")
+                logger.info(f"  Valid voucher relationships: {result['valid_voucher_relationships']:,}")
+                
+                if result['entries_with_voucher_id'] > 0:
+                    relationship_percentage = (result['valid_voucher_relationships'] / result['entries_with_voucher_id']) * 100
+                    logger.info(f"  Relationship integrity: {relationship_percentage:.1f}%")
+                
+                # Orphaned records were counted by the same joins above
+                logger.info("\n📋 ORPHANED RECORDS ANALYSIS:")
+                logger.info(f"  Orphaned ledger entries: {orphaned_ledger_entries:,}")
+                logger.info(f"  Orphaned inventory entries: {orphaned_inventory_entries:,}")
+                
         except Exception as e:
             logger.error(f"❌ Error analyzing relationships: {e}")
+    
+    def _fetch_all(self, query):
+        """Run one read-only query on its own pooled connection and return all rows."""
+        with self._cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
+    
+    def ensure_pattern_views(self, refresh=False):
+        """Create the PATTERN_VIEWS that are missing and refresh any that look stale.
+        
+        Each view's comment records its source table's n_tup_ins + n_tup_upd + n_tup_del from
+        pg_stat_user_tables when it was built, and a different counter means rows were written
+        since. This is approximate: the counters are not transactional (rolled-back writes
+        count), lag the most recent writes, and restart when statistics are reset, so a view
+        can be refreshed needlessly or miss writes made moments ago. `refresh` forces it.
+        """
+        supabase_conn = self._getconn()
+        if supabase_conn is None:
+            return False
+        
+        try:
+            cursor = supabase_conn.cursor()
+            for name, (table, column, query) in PATTERN_VIEWS.items():
+                cursor.execute('''
+                    SELECT to_regclass(%s) IS NOT NULL,
+                           obj_description(to_regclass(%s), 'pg_class'),
+                           (SELECT n_tup_ins + n_tup_upd + n_tup_del
+                            FROM pg_stat_user_tables WHERE relid = %s::regclass)::text
+                ''', (name, name, table))
+                exists, built_at_writes, table_writes = cursor.fetchone()
+                
+                cursor.execute(f'CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query}')
+                # A unique index lets the view be refreshed CONCURRENTLY without blocking readers
+                cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name}({column})')
+                if exists:
+                    if not refresh:
+                        if built_at_writes == table_writes:
+                            continue
+                        logger.info(f"🔄 {table} has changed since {name} was built, refreshing it")
+                    cursor.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {name}')
+                cursor.execute(f'COMMENT ON MATERIALIZED VIEW {name} IS %s', (table_writes,))
+            supabase_conn.commit()
+            logger.info(f"✅ Verified {len(PATTERN_VIEWS)} pattern views")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️  Could not prepare pattern views, distributions will be computed directly: {e}")
+            supabase_conn.rollback()
+            return False
         finally:
-            self.supabase_manager.disconnect()
+            self.pool.putconn(supabase_conn)
+    
+    def refresh_pattern_views(self):
+        """Refresh the cached distributions read by analyze_data_patterns."""
+        logger.info("🔄 Refreshing pattern views...")
+        if self.ensure_pattern_views(refresh=True):
+            logger.info("✅ Pattern views refreshed")
+    
+    def _stream_aggregate(self, query, handler):
+        """COPY a large result set out as CSV, passing each row (a list of strings) to `handler`.
+        
+        Avoids per-row fetch overhead for full distributions; returns the row count.
+        """
+        with self._cursor() as cursor, tempfile.TemporaryFile() as sink:
+            cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv)', sink)
+            sink.seek(0)
+            
+            row_count = 0
+            encoding = psycopg2.extensions.encodings[cursor.connection.encoding]
+            for row in csv.reader(io.TextIOWrapper(sink, encoding=encoding, newline='')):
+                handler(row)
+                row_count += 1
+        return row_count
     
     def analyze_data_patterns(self):
-        """Analyze data patterns and distributions."""
+        """Analyze data patterns and distributions.
+        
+        The top-N distributions (voucher types, ledger names, stock item names) are read
+        from the PATTERN_VIEWS set up by ensure_pattern_views; a missing view is replaced by
+        its defining query, so this only ever reads.
+        """
         logger.info("📈 Analyzing data patterns...")
         
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(
+                    'SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NOT NULL',
+                    (list(PATTERN_VIEWS),)
+                )
+                existing_views = {row['name'] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Error analyzing data patterns: {e}")
             return
         
+        if len(existing_views) < len(PATTERN_VIEWS):
+            logger.info("  ℹ️  Pattern views missing, aggregating the tables directly")
+        
+        queries = []
+        for name, (_, column, query) in PATTERN_VIEWS.items():
+            source = name if name in existing_views else f'({query}) AS {name}'
+            queries.append(f'SELECT {column}, count FROM {source} ORDER BY count DESC LIMIT 10')
+        
+        queries.append(
+            # Date ranges
+            '''
+                SELECT 
+                    MIN(date) as earliest_date,
+                    MAX(date) as latest_date,
+                    COUNT(DISTINCT date) as unique_dates
+                FROM vouchers
+                WHERE date IS NOT NULL
+            '''
+        )
+        
         try:
-            cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute('SET search_path TO tally, public')
+            # The aggregates are independent, so run them concurrently on separate
+            # pooled connections; wall time is bounded by the slowest one
+            with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                voucher_types, ledger_names, stock_items, date_range = executor.map(self._fetch_all, queries)
             
-            # Analyze voucher types
             logger.info("📋 VOUCHER TYPES DISTRIBUTION:")
-            cursor.execute('''
-                SELECT voucher_type, COUNT(*) as count
-                FROM vouchers
-                WHERE voucher_type IS NOT NULL
-                GROUP BY voucher_type
-                ORDER BY count DESC
-                LIMIT 10
-            ''')
-            voucher_types = cursor.fetchall()
             for vt in voucher_types:
                 logger.info(f"  {vt['voucher_type']}: {vt['count']:,} vouchers")
             
-            # Analyze ledger names
             logger.info("\n📋 TOP LEDGER NAMES:")
-            cursor.execute('''
-                SELECT ledger_name, COUNT(*) as count
-                FROM ledger_entries
-                WHERE ledger_name IS NOT NULL AND ledger_name != ''
-                GROUP BY ledger_name
-                ORDER BY count DESC
-                LIMIT 10
-            ''')
-            ledger_names = cursor.fetchall()
             for ln in ledger_names:
                 logger.info(f"  {ln['ledger_name']}: {ln['count']:,} entries")
             
-            # Analyze stock item names
             logger.info("\n📋 TOP STOCK ITEM NAMES:")
-            cursor.execute('''
-                SELECT stock_item_name, COUNT(*) as count
-                FROM inventory_entries
-                WHERE stock_item_name IS NOT NULL AND stock_item_name != ''
-                GROUP BY stock_item_name
-                ORDER BY count DESC
-                LIMIT 10
-            ''')
-            stock_items = cursor.fetchall()
             for si in stock_items:
                 logger.info(f"  {si['stock_item_name']}: {si['count']:,} entries")
             
-            # Analyze date ranges
             logger.info("\n📋 DATE RANGE ANALYSIS:")
-            cursor.execute('''
-                SELECT 
-                    MIN(date) as earliest_date,
-                    MAX(date) as latest_date,
-                    COUNT(DISTINCT date) as unique_dates
-                FROM vouchers
-                WHERE date IS NOT NULL
-            ''')
-            result = cursor.fetchone()
+            result = date_range[0]
             logger.info(f"  Date range: {result['earliest_date']} to {result['latest_date']}")
             logger.info(f"  Unique dates: {result['unique_dates']:,}")
             
         except Exception as e:
             logger.error(f"❌ Error analyzing data patterns: {e}")
-        finally:
-            self.supabase_manager.disconnect()
     
     def generate_sample_queries(self):
         """Generate sample queries to test the data."""
         logger.info("🔍 Generating sample queries...")
         
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
-            return
-        
         try:
-            cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute('SET search_path TO tally, public')
-            
-            # Sample query 1: Voucher with its ledger and inventory entries
-            logger.info("📋 SAMPLE QUERY 1: Voucher with related entries")
-            cursor.execute('''
-                SELECT 
-                    v.guid,
-                    v.date,
-                    v.voucher_number,
-                    v.voucher_type,
-                    v.narration,
-                    COUNT(le.id) as ledger_entry_count,
-                    COUNT(ie.id) as inventory_entry_count
-                FROM vouchers v
-                LEFT JOIN ledger_entries le ON v.id = le.voucher_id
-                LEFT JOIN inventory_entries ie ON v.id = ie.voucher_id
-                GROUP BY v.id, v.guid, v.date, v.voucher_number, v.voucher_type, v.narration
-                ORDER BY v.date DESC
-                LIMIT 5
-            ''')
-            results = cursor.fetchall()
-            for result in results:
-                logger.info(f"  Voucher {result['guid'][:20]}... ({result['date']}): {result['ledger_entry_count']} ledger, {result['inventory_entry_count']} inventory entries")
-            
-            # Sample query 2: Top vouchers by amount
-            logger.info("\n📋 SAMPLE QUERY 2: Top vouchers by ledger amount")
-            cursor.execute('''
-                SELECT 
-                    v.guid,
-                    v.date,
-                    v.voucher_number,
-                    v.voucher_type,
-                    SUM(le.amount) as total_amount
-                FROM vouchers v
-                JOIN ledger_entries le ON v.id = le.voucher_id
-                WHERE le.amount IS NOT NULL
-                GROUP BY v.id, v.guid, v.date, v.voucher_number, v.voucher_type
-                ORDER BY total_amount DESC
-                LIMIT 5
-            ''')
-            results = cursor.fetchall()
-            for result in results:
-                logger.info(f"  Voucher {result['guid'][:20]}... ({result['date']}): ₹{result['total_amount']:,.2f}")
-            
+            with self._cursor() as cursor:
+                # Sample query 1: Voucher with its ledger and inventory entries
+                logger.info("📋 SAMPLE QUERY 1: Voucher with related entries")
+                cursor.execute('''
+                    SELECT 
+                        v.guid,
+                        v.date,
+                        v.voucher_number,
+                        v.voucher_type,
+                        v.narration,
+                        le.ledger_entry_count,
+                        ie.inventory_entry_count
+                    FROM (
+                        -- Pick the 5 vouchers first so only they are joined and counted
+                        SELECT id, guid, date, voucher_number, voucher_type, narration
+                        FROM vouchers
+                        ORDER BY date DESC
+                        LIMIT 5
+                    ) v
+                    LEFT JOIN LATERAL (
+                        SELECT COUNT(*) as ledger_entry_count FROM ledger_entries WHERE voucher_id = v.id
+                    ) le ON true
+                    LEFT JOIN LATERAL (
+                        SELECT COUNT(*) as inventory_entry_count FROM inventory_entries WHERE voucher_id = v.id
+                    ) ie ON true
+                    ORDER BY v.date DESC
+                ''')
+                results = cursor.fetchall()
+                for result in results:
+                    logger.info(f"  Voucher {result['guid'][:20]}... ({result['date']}): {result['ledger_entry_count']} ledger, {result['inventory_entry_count']} inventory entries")
+                
+                # Sample query 2: Top vouchers by amount
+                logger.info("\n📋 SAMPLE QUERY 2: Top vouchers by ledger amount")
+                cursor.execute('''
+                    SELECT 
+                        v.guid,
+                        v.date,
+                        v.voucher_number,
+                        v.voucher_type,
+                        SUM(le.amount) as total_amount
+                    FROM vouchers v
+                    JOIN ledger_entries le ON v.id = le.voucher_id
+                    WHERE le.amount IS NOT NULL
+                    GROUP BY v.id, v.guid, v.date, v.voucher_number, v.voucher_type
+                    ORDER BY total_amount DESC
+                    LIMIT 5
+                ''')
+                results = cursor.fetchall()
+                for result in results:
+                    logger.info(f"  Voucher {result['guid'][:20]}... ({result['date']}): ₹{result['total_amount']:,.2f}")
+                
         except Exception as e:
             logger.error(f"❌ Error generating sample queries: {e}")
-        finally:
-            self.supabase_manager.disconnect()
     
-    def run_full_analysis(self):
+    def run_full_analysis(self, refresh_patterns=False, exact_counts=False):
         """Run complete data quality analysis."""
         logger.info("🚀 Starting comprehensive data quality analysis...")
         logger.info("=" * 60)
         
-        self.analyze_table_counts()
-        logger.info("=" * 60)
-        
-        self.analyze_data_quality()
-        logger.info("=" * 60)
-        
-        self.analyze_relationships()
-        logger.info("=" * 60)
-        
-        self.analyze_data_patterns()
-        logger.info("=" * 60)
-        
-        self.generate_sample_queries()
-        logger.info("=" * 60)
+        try:
+            # One-time setup; the analyses below only read
+            self.ensure_indexes()
+            if refresh_patterns:
+                self.refresh_pattern_views()
+            else:
+                self.ensure_pattern_views()
+            
+            self.analyze_table_counts(exact=exact_counts)
+            logger.info("=" * 60)
+            
+            self.analyze_data_quality()
+            logger.info("=" * 60)
+            
+            self.analyze_relationships()
+            logger.info("=" * 60)
+            
+            self.analyze_data_patterns()
+            logger.info("=" * 60)
+            
+            self.generate_sample_queries()
+            logger.info("=" * 60)
+        finally:
+            self.close()
         
         logger.info("✅ Data quality analysis completed!")
 
 def main():
+    parser = argparse.ArgumentParser(description='Data Quality Analysis')
+    parser.add_argument('--refresh-patterns', action='store_true',
+                       help='Force a refresh of the materialized views behind the data pattern distributions '
+                            '(views are refreshed automatically when their tables have changed)')
+    parser.add_argument('--exact-counts', action='store_true',
+                       help='Count table rows with COUNT(*) instead of reporting planner estimates')
+    
+    args = parser.parse_args()
+    
     analysis = DataQualityAnalysis()
-    analysis.run_full_analysis()
+    analysis.run_full_analysis(refresh_patterns=args.refresh_patterns, exact_counts=args.exact_counts)
 
 if __name__ == "__main__":
     main()
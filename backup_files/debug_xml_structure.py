@@ -3,6 +3,7 @@
 Debug XML Structure - See what we're actually getting from Tally
 """
 
+import io
 import logging
 import xml.etree.ElementTree as ET
 from tally_client import TallyClient
@@ -26,54 +27,61 @@ def debug_xml_structure():
         
         logger.info(f"✅ Received {len(response)} characters from Tally")
         
-        # Parse the XML response
-        root = ET.fromstring(response)
+        # Stream the XML once, classifying each element by prefix and keeping only
+        # the first few samples of each kind instead of building the whole tree
+        prefixes = ('VOUCHER_', 'TRN_LEDGERENTRIES_', 'TRN_INVENTORYENTRIES_')
+        counts = dict.fromkeys(prefixes, 0)
+        samples = {prefix: [] for prefix in prefixes}
+        root = None
+        root_children = []
+        root_children_count = 0
+        depth = 0
         
-        # Find all elements that start with VOUCHER_
-        voucher_elements = []
-        for elem in root.iter():
-            if elem.tag.startswith('VOUCHER_'):
-                voucher_elements.append(elem)
+        for event, elem in ET.iterparse(io.StringIO(response), events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            
+            depth -= 1
+            for prefix in prefixes:
+                if elem.tag.startswith(prefix):
+                    counts[prefix] += 1
+                    if len(samples[prefix]) < 5:
+                        samples[prefix].append((elem.tag, elem.text))
+                    break
+            
+            if depth == 1:
+                root_children_count += 1
+                if len(root_children) < 10:
+                    root_children.append((elem.tag, elem.text))
+                root.clear()
+            elif depth > 1:
+                elem.clear()
         
-        logger.info(f"📊 Found {len(voucher_elements)} VOUCHER_ elements")
-        
-        # Show first few voucher elements
-        for i, elem in enumerate(voucher_elements[:5]):
-            logger.info(f"Voucher element {i+1}: {elem.tag} = {elem.text}")
-        
-        # Find all elements that start with TRN_LEDGERENTRIES_
-        ledger_elements = []
-        for elem in root.iter():
-            if elem.tag.startswith('TRN_LEDGERENTRIES_'):
-                ledger_elements.append(elem)
-        
-        logger.info(f"📊 Found {len(ledger_elements)} TRN_LEDGERENTRIES_ elements")
-        
-        # Show first few ledger elements
-        for i, elem in enumerate(ledger_elements[:5]):
-            logger.info(f"Ledger element {i+1}: {elem.tag} = {elem.text}")
-        
-        # Find all elements that start with TRN_INVENTORYENTRIES_
-        inventory_elements = []
-        for elem in root.iter():
-            if elem.tag.startswith('TRN_INVENTORYENTRIES_'):
-                inventory_elements.append(elem)
-        
-        logger.info(f"📊 Found {len(inventory_elements)} TRN_INVENTORYENTRIES_ elements")
-        
-        # Show first few inventory elements
-        for i, elem in enumerate(inventory_elements[:5]):
-            logger.info(f"Inventory element {i+1}: {elem.tag} = {elem.text}")
-        
-        # Let's also check what the root structure looks like
-        logger.info(f"📊 Root tag: {root.tag}")
-        logger.info(f"📊 Root children count: {len(list(root))}")
-        
-        # Show first few direct children
-        for i, child in enumerate(list(root)[:10]):
-            logger.info(f"Root child {i+1}: {child.tag}")
-            if child.text and child.text.strip():
-                logger.info(f"  Text: {child.text.strip()}")
+        # Emit the summary as one log record rather than one call per sample line
+        if logger.isEnabledFor(logging.INFO):
+            lines = []
+            for prefix, label in zip(prefixes, ('Voucher', 'Ledger', 'Inventory')):
+                lines.append(f"📊 Found {counts[prefix]} {prefix} elements")
+                
+                # Show first few elements
+                lines.extend(
+                    f"{label} element {i+1}: {tag} = {text}" for i, (tag, text) in enumerate(samples[prefix])
+                )
+            
+            # Let's also check what the root structure looks like
+            lines.append(f"📊 Root tag: {root.tag}")
+            lines.append(f"📊 Root children count: {root_children_count}")
+            
+            # Show first few direct children
+            for i, (tag, text) in enumerate(root_children):
+                lines.append(f"Root child {i+1}: {tag}")
+                if text and text.strip():
+                    lines.append(f"  Text: {text.strip()}")
+            
+            logger.info('\n'.join(lines))
         
     except Exception as e:
         logger.error(f"❌ Error debugging XML structure: {e}")
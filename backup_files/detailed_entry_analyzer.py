@@ -4,38 +4,68 @@ Detailed Entry Analyzer for Tally XML
 Analyzes voucher entries to detect multiple ledger or inventory entries per voucher.
 """
 
+import mmap
 import re
-from typing import Dict, List, Any
+from typing import Dict, Iterator, List, Any
 from collections import defaultdict
 
+# Compiled once, in bytes mode so they run directly over the memory-mapped export.
+# ENTRY_RE finds all three entry kinds in a single pass per voucher.
+ENTRY_RE = re.compile(
+    rb'<(TRN_LEDGERENTRIES_LEDGER_NAME|TRN_INVENTORYENTRIES_STOCKITEM_NAME|TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME)>'
+    rb'([^<]*)</\1>'
+)
+ENTRY_KINDS = {
+    b'TRN_LEDGERENTRIES_LEDGER_NAME': 'ledger',
+    b'TRN_INVENTORYENTRIES_STOCKITEM_NAME': 'inventory',
+    b'TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME': 'accounting',
+}
+WRAPPER_TAG_RE = re.compile(rb'<\?xml[^>]*\?>|<TALLYMESSAGE[^>]*>|</TALLYMESSAGE>|<ENVELOPE[^>]*>|</ENVELOPE>')
+VOUCHER_TAG = b'<VOUCHER_AMOUNT>'
+VOUCHER_ID_RE = re.compile(rb'<VOUCHER_ID>([^<]*)</VOUCHER_ID>')
+VOUCHER_AMOUNT_RE = re.compile(rb'<VOUCHER_AMOUNT>([^<]*)</VOUCHER_AMOUNT>')
+VOUCHER_TYPE_RE = re.compile(rb'<VOUCHER_VOUCHER_TYPE>([^<]*)</VOUCHER_VOUCHER_TYPE>')
+
+
+def _decode(value: bytes) -> str:
+    return value.decode('utf-8', errors='replace')
+
+
+def find_entries(voucher_content: bytes) -> Dict[str, List[str]]:
+    """Return the ledger, inventory and accounting entry names in a voucher."""
+    entries = {'ledger': [], 'inventory': [], 'accounting': []}
+    for match in ENTRY_RE.finditer(voucher_content):
+        entries[ENTRY_KINDS[match.group(1)]].append(_decode(match.group(2)))
+    return entries
+
+
+def iter_vouchers(data) -> Iterator[bytes]:
+    """Yield each voucher's bytes, starting at its <VOUCHER_AMOUNT> tag, without wrapper tags."""
+    start = data.find(VOUCHER_TAG)
+    while start != -1:
+        end = data.find(VOUCHER_TAG, start + len(VOUCHER_TAG))
+        voucher_content = data[start:end if end != -1 else len(data)]
+        yield WRAPPER_TAG_RE.sub(b'', voucher_content).strip()
+        start = end
+
 
 def analyze_voucher_entries(xml_file_path: str) -> Dict[str, Any]:
     """Analyze voucher entries in detail."""
     
-    with open(xml_file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-    
-    # Clean content
-    content = re.sub(r'<\?xml[^>]*\?>', '', content)
-    content = re.sub(r'<TALLYMESSAGE[^>]*>', '', content)
-    content = re.sub(r'</TALLYMESSAGE>', '', content)
-    content = re.sub(r'<ENVELOPE[^>]*>', '', content)
-    content = re.sub(r'</ENVELOPE>', '', content)
-    
-    # Split into vouchers
-    voucher_pattern = r'<VOUCHER_AMOUNT>'
-    matches = list(re.finditer(voucher_pattern, content))
-    
-    vouchers = []
-    for i, match in enumerate(matches):
-        start_pos = match.start()
-        end_pos = matches[i + 1].start() if i + 1 < len(matches) else len(content)
-        voucher_content = content[start_pos:end_pos].strip()
-        vouchers.append(voucher_content)
+    # Map the file instead of reading it so only one voucher at a time is copied into memory
+    with open(xml_file_path, 'rb') as file:
+        if not file.read(1):
+            return _analyze_vouchers(iter(()))
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return _analyze_vouchers(iter_vouchers(content))
+
+
+def _analyze_vouchers(vouchers: Iterator[bytes]) -> Dict[str, Any]:
+    """Build the entry analysis from a stream of voucher byte strings."""
     
     # Analyze each voucher
     analysis = {
-        'total_vouchers': len(vouchers),
+        'total_vouchers': 0,
         'vouchers_with_multiple_ledger_entries': [],
         'vouchers_with_multiple_inventory_entries': [],
         'vouchers_with_multiple_accounting_entries': [],
@@ -43,70 +73,71 @@ def analyze_voucher_entries(xml_file_path: str) -> Dict[str, Any]:
         'sample_vouchers': []
     }
     
-    for i, voucher_content in enumerate(vouchers[:20]):  # Analyze first 20 in detail
-        voucher_analysis = analyze_single_voucher_detailed(voucher_content, i + 1)
-        analysis['sample_vouchers'].append(voucher_analysis)
-        
-        # Count patterns
-        ledger_count = len(re.findall(r'<TRN_LEDGERENTRIES_LEDGER_NAME>', voucher_content))
-        inventory_count = len(re.findall(r'<TRN_INVENTORYENTRIES_STOCKITEM_NAME>', voucher_content))
-        accounting_count = len(re.findall(r'<TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME>', voucher_content))
+    # Count patterns for every voucher in one pass, analyzing the first 20 in detail
+    for i, voucher_content in enumerate(vouchers):
+        if i < 20:
+            voucher_analysis = analyze_single_voucher_detailed(voucher_content, i + 1)
+            analysis['sample_vouchers'].append(voucher_analysis)
+            ledger_count = voucher_analysis['ledger_count']
+            inventory_count = voucher_analysis['inventory_count']
+            accounting_count = voucher_analysis['accounting_count']
+        else:
+            # Only counts are needed here; bytes.count is a plain memory scan
+            ledger_count = voucher_content.count(b'<TRN_LEDGERENTRIES_LEDGER_NAME>')
+            inventory_count = voucher_content.count(b'<TRN_INVENTORYENTRIES_STOCKITEM_NAME>')
+            accounting_count = voucher_content.count(b'<TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME>')
         
         pattern_key = f"L:{ledger_count}_I:{inventory_count}_A:{accounting_count}"
         analysis['entry_patterns'][pattern_key] += 1
+        analysis['total_vouchers'] += 1
+        
+        if i >= 20:
+            continue
         
         if ledger_count > 1:
             analysis['vouchers_with_multiple_ledger_entries'].append({
                 'voucher_number': i + 1,
                 'ledger_count': ledger_count,
-                'content_preview': voucher_content[:200] + "..."
+                'content_preview': _decode(voucher_content[:200]) + "..."
             })
         
         if inventory_count > 1:
             analysis['vouchers_with_multiple_inventory_entries'].append({
                 'voucher_number': i + 1,
                 'inventory_count': inventory_count,
-                'content_preview': voucher_content[:200] + "..."
+                'content_preview': _decode(voucher_content[:200]) + "..."
             })
         
         if accounting_count > 1:
             analysis['vouchers_with_multiple_accounting_entries'].append({
                 'voucher_number': i + 1,
                 'accounting_count': accounting_count,
-                'content_preview': voucher_content[:200] + "..."
+                'content_preview': _decode(voucher_content[:200]) + "..."
             })
     
-    # Analyze all vouchers for patterns
-    for voucher_content in vouchers:
-        ledger_count = len(re.findall(r'<TRN_LEDGERENTRIES_LEDGER_NAME>', voucher_content))
-        inventory_count = len(re.findall(r'<TRN_INVENTORYENTRIES_STOCKITEM_NAME>', voucher_content))
-        accounting_count = len(re.findall(r'<TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME>', voucher_content))
-        
-        pattern_key = f"L:{ledger_count}_I:{inventory_count}_A:{accounting_count}"
-        analysis['entry_patterns'][pattern_key] += 1
-    
     return analysis
 
 
-def analyze_single_voucher_detailed(voucher_content: str, voucher_number: int) -> Dict[str, Any]:
+def analyze_single_voucher_detailed(voucher_content: bytes, voucher_number: int) -> Dict[str, Any]:
     """Analyze a single voucher in detail."""
     
     # Extract voucher ID
-    voucher_id_match = re.search(r'<VOUCHER_ID>([^<]*)</VOUCHER_ID>', voucher_content)
-    voucher_id = voucher_id_match.group(1) if voucher_id_match else ''
+    voucher_id_match = VOUCHER_ID_RE.search(voucher_content)
+    voucher_id = _decode(voucher_id_match.group(1)) if voucher_id_match else ''
     
     # Count different types of entries
-    ledger_entries = re.findall(r'<TRN_LEDGERENTRIES_LEDGER_NAME>([^<]*)</TRN_LEDGERENTRIES_LEDGER_NAME>', voucher_content)
-    inventory_entries = re.findall(r'<TRN_INVENTORYENTRIES_STOCKITEM_NAME>([^<]*)</TRN_INVENTORYENTRIES_STOCKITEM_NAME>', voucher_content)
-    accounting_entries = re.findall(r'<TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME>([^<]*)</TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME>', voucher_content)
+    entries = find_entries(voucher_content)
+    ledger_entries = entries['ledger']
+    inventory_entries = entries['inventory']
+    accounting_entries = entries['accounting']
     
     # Extract voucher amount
-    voucher_amount_match = re.search(r'<VOUCHER_AMOUNT>([^<]*)</VOUCHER_AMOUNT>', voucher_content)
-    voucher_amount = voucher_amount_match.group(1) if voucher_amount_match else ''
+    voucher_amount_match = VOUCHER_AMOUNT_RE.search(voucher_content)
+    voucher_amount = _decode(voucher_amount_match.group(1)) if voucher_amount_match else ''
     
     # Extract voucher type
-    voucher_type_match = re.search(r'<VOUCHER_VOUCHER_TYPE>([^<]*)</VOUCHER_VOUCHER_TYPE>', voucher_content)
-    voucher_type = voucher_type_match.group(1) if voucher_type_match else ''
+    voucher_type_match = VOUCHER_TYPE_RE.search(voucher_content)
+    voucher_type = _decode(voucher_type_match.group(1)) if voucher_type_match else ''
     
     return {
         'voucher_number': voucher_number,
@@ -5,85 +5,194 @@ Provides a comprehensive analysis of the XML structure focusing on ledger and in
 """
 
 import re
-from typing import Dict, List, Any
-from collections import defaultdict
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+from collections import Counter, defaultdict
+
+from xml_stream import iter_elements
+
+VOUCHER_TAGS = [
+    'VOUCHER_ID',
+    'VOUCHER_AMOUNT',
+    'VOUCHER_DATE',
+    'VOUCHER_VOUCHER_TYPE',
+    'VOUCHER_NARRATION'
+]
+
+LEDGER_TAGS = [
+    'TRN_LEDGERENTRIES_AMOUNT',
+    'TRN_LEDGERENTRIES_ID', 
+    'TRN_LEDGERENTRIES_IS_DEBIT',
+    'TRN_LEDGERENTRIES_LEDGER_NAME'
+]
+
+INVENTORY_TAGS = [
+    'TRN_INVENTORYENTRIES_AMOUNT',
+    'TRN_INVENTORYENTRIES_ID',
+    'TRN_INVENTORYENTRIES_QUANTITY',
+    'TRN_INVENTORYENTRIES_RATE',
+    'TRN_INVENTORYENTRIES_STOCKITEM_NAME'
+]
+
+ACCOUNTING_TAGS = [
+    'TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME',
+    'TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_AMOUNT',
+    'TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_ISDEEMEDPOSITIVE'
+]
+
+KNOWN_TAGS = VOUCHER_TAGS + LEDGER_TAGS + INVENTORY_TAGS + ACCOUNTING_TAGS
+
+WRAPPER_TAGS = ('ENVELOPE', 'TALLYMESSAGE')
+
+# Vouchers analyzed in detail; past these only the entry counts are used
+SAMPLE_VOUCHERS = 10
+# Tags counted per voucher for the (ledger, inventory) entry patterns
+COUNTED_TAGS = ('TRN_LEDGERENTRIES_LEDGER_NAME', 'TRN_INVENTORYENTRIES_STOCKITEM_NAME')
+
+# (tag, entry key) pairs for extract_entries, so the key isn't re-derived per voucher
+LEDGER_FIELDS = [(tag, tag[len('TRN_LEDGERENTRIES_'):].lower()) for tag in LEDGER_TAGS]
+INVENTORY_FIELDS = [(tag, tag[len('TRN_INVENTORYENTRIES_'):].lower()) for tag in INVENTORY_TAGS]
+ACCOUNTING_FIELDS = [(tag, tag[len('TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_'):].lower()) for tag in ACCOUNTING_TAGS]
+
+# Compiled once for the regex fallback in scan_voucher_fields
+ALL_TAGS_RE = re.compile(r'<(' + '|'.join(map(re.escape, KNOWN_TAGS)) + r')>([^<]*)</\1>')
+VOUCHER_START = '<VOUCHER_AMOUNT>'
+CLEAN_RE = re.compile(r'<\?xml[^>]*\?>|</?TALLYMESSAGE[^>]*>|</?ENVELOPE[^>]*>')
 
 
 def analyze_tally_xml_structure(xml_file_path: str) -> Dict[str, Any]:
     """Analyze the structure of Tally XML file."""
     
+    try:
+        return analyze_voucher_fields(iter_voucher_fields(xml_file_path))
+    except ET.ParseError:
+        # Tally exports are not always well-formed (e.g. bare '&'); fall back to scanning the text
+        return analyze_voucher_fields(scan_voucher_fields(xml_file_path))
+
+
+def count_entries(fields: Dict[str, List[str]]) -> Tuple[int, int]:
+    """Return how many values each of COUNTED_TAGS has in a voucher's fields."""
+    ledger_tag, inventory_tag = COUNTED_TAGS
+    return len(fields.get(ledger_tag, ())), len(fields.get(inventory_tag, ()))
+
+
+def iter_voucher_fields(xml_file_path: str) -> Iterator[Tuple[Dict[str, List[str]], Tuple[int, int]]]:
+    """Stream the flat Tally XML, yielding each voucher's tag values keyed by tag name,
+    with its (ledger, inventory) entry counts.
+    
+    A voucher starts at its <VOUCHER_AMOUNT> tag and runs until the next one.
+    Elements are dropped as soon as they are read, so memory stays bounded.
+    """
+    fields = None
+    
+    for tag, text in iter_elements(ET.iterparse(xml_file_path, events=('start', 'end'))):
+        if tag not in WRAPPER_TAGS:
+            if tag == 'VOUCHER_AMOUNT':
+                if fields is not None:
+                    yield fields, count_entries(fields)
+                fields = defaultdict(list)
+            if fields is not None:
+                fields[tag].append((text or '').strip())
+    
+    if fields is not None:
+        yield fields, count_entries(fields)
+
+
+def scan_voucher_fields(xml_file_path: str) -> Iterator[Tuple[Optional[Dict[str, List[str]]], Tuple[int, int]]]:
+    """Regex fallback for iter_voucher_fields when the export is not well-formed XML.
+    
+    Past the first SAMPLE_VOUCHERS only the entry counts are read, so fields is None there.
+    """
+    
     with open(xml_file_path, 'r', encoding='utf-8') as file:
         content = file.read()
     
-    # Clean content
-    content = re.sub(r'<\?xml[^>]*\?>', '', content)
-    content = re.sub(r'<TALLYMESSAGE[^>]*>', '', content)
-    content = re.sub(r'</TALLYMESSAGE>', '', content)
-    content = re.sub(r'<ENVELOPE[^>]*>', '', content)
-    content = re.sub(r'</ENVELOPE>', '', content)
+    # Clean content in a single pass
+    content = CLEAN_RE.sub('', content)
     
-    # Split into vouchers
-    voucher_pattern = r'<VOUCHER_AMOUNT>'
-    matches = list(re.finditer(voucher_pattern, content))
+    for i, voucher_content in enumerate(iter_vouchers(content)):
+        if i >= SAMPLE_VOUCHERS:
+            # The tags are literals, so str.count does it without the regex engine
+            ledger_tag, inventory_tag = COUNTED_TAGS
+            yield None, (voucher_content.count(f'<{ledger_tag}>'), voucher_content.count(f'<{inventory_tag}>'))
+            continue
+        
+        fields = defaultdict(list)
+        # One pass over the voucher picks up every known tag
+        for match in ALL_TAGS_RE.finditer(voucher_content):
+            fields[match.group(1)].append(match.group(2).strip())
+        yield fields, count_entries(fields)
+
+
+def iter_vouchers(content: str) -> Iterator[str]:
+    """Yield each voucher's text, from its <VOUCHER_AMOUNT> tag up to the next one."""
+    # The start tag is a literal, so str.find beats a regex
+    start = content.find(VOUCHER_START)
+    while start != -1:
+        end = content.find(VOUCHER_START, start + len(VOUCHER_START))
+        yield content[start:end if end != -1 else len(content)].strip()
+        start = end
+
+
+def analyze_voucher_fields(
+    vouchers: Iterator[Tuple[Optional[Dict[str, List[str]]], Tuple[int, int]]]
+) -> Dict[str, Any]:
+    """Build the structure analysis from per-voucher (fields, (ledger, inventory) entry counts).
     
-    vouchers = []
-    for i, match in enumerate(matches):
-        start_pos = match.start()
-        end_pos = matches[i + 1].start() if i + 1 < len(matches) else len(content)
-        voucher_content = content[start_pos:end_pos].strip()
-        vouchers.append(voucher_content)
+    fields is only read for the first SAMPLE_VOUCHERS vouchers and may be None after them.
+    """
     
     # Analyze structure
     analysis = {
-        'total_vouchers': len(vouchers),
+        'total_vouchers': 0,
         'voucher_structure': [],
-        'ledger_entry_patterns': defaultdict(int),
-        'inventory_entry_patterns': defaultdict(int),
+        # Entry count -> number of vouchers; labels are formatted when printing
+        'ledger_entry_patterns': Counter(),
+        'inventory_entry_patterns': Counter(),
         'vouchers_with_inventory': 0,
         'vouchers_without_inventory': 0,
         'sample_vouchers': []
     }
     
-    for i, voucher_content in enumerate(vouchers[:10]):  # Analyze first 10 vouchers in detail
-        voucher_analysis = analyze_single_voucher(voucher_content, i + 1)
-        analysis['voucher_structure'].append(voucher_analysis)
-        analysis['sample_vouchers'].append(voucher_analysis)
+    for i, (fields, (ledger_count, inventory_count)) in enumerate(vouchers):
+        analysis['total_vouchers'] += 1
         
-        # Count patterns
-        if voucher_analysis['has_inventory_item']:
-            analysis['vouchers_with_inventory'] += 1
-        else:
-            analysis['vouchers_without_inventory'] += 1
-    
-    # Count patterns across all vouchers
-    for voucher_content in vouchers:
-        ledger_count = len(re.findall(r'<TRN_LEDGERENTRIES_LEDGER_NAME>', voucher_content))
-        inventory_count = len(re.findall(r'<TRN_INVENTORYENTRIES_STOCKITEM_NAME>', voucher_content))
+        if i < SAMPLE_VOUCHERS:  # Analyze the first vouchers in detail
+            voucher_analysis = analyze_single_voucher(fields, i + 1)
+            analysis['voucher_structure'].append(voucher_analysis)
+            analysis['sample_vouchers'].append(voucher_analysis)
+            
+            # Count patterns
+            if voucher_analysis['has_inventory_item']:
+                analysis['vouchers_with_inventory'] += 1
+            else:
+                analysis['vouchers_without_inventory'] += 1
         
-        analysis['ledger_entry_patterns'][f'{ledger_count}_ledger_entries'] += 1
-        analysis['inventory_entry_patterns'][f'{inventory_count}_inventory_entries'] += 1
+        # Count patterns across all vouchers
+        analysis['ledger_entry_patterns'][ledger_count] += 1
+        analysis['inventory_entry_patterns'][inventory_count] += 1
     
     return analysis
 
 
-def analyze_single_voucher(voucher_content: str, voucher_number: int) -> Dict[str, Any]:
+def analyze_single_voucher(fields: Dict[str, List[str]], voucher_number: int) -> Dict[str, Any]:
     """Analyze a single voucher."""
     
     # Extract basic info
-    voucher_id = extract_tag_value(voucher_content, 'VOUCHER_ID')
-    voucher_amount = extract_tag_value(voucher_content, 'VOUCHER_AMOUNT')
-    voucher_date = extract_tag_value(voucher_content, 'VOUCHER_DATE')
-    voucher_type = extract_tag_value(voucher_content, 'VOUCHER_VOUCHER_TYPE')
-    voucher_narration = extract_tag_value(voucher_content, 'VOUCHER_NARRATION')
+    voucher_id = extract_tag_value(fields, 'VOUCHER_ID')
+    voucher_amount = extract_tag_value(fields, 'VOUCHER_AMOUNT')
+    voucher_date = extract_tag_value(fields, 'VOUCHER_DATE')
+    voucher_type = extract_tag_value(fields, 'VOUCHER_VOUCHER_TYPE')
+    voucher_narration = extract_tag_value(fields, 'VOUCHER_NARRATION')
     
     # Extract ledger entries
-    ledger_entries = extract_ledger_entries(voucher_content)
+    ledger_entries = extract_entries(fields, LEDGER_FIELDS)
     
     # Extract inventory entries
-    inventory_entries = extract_inventory_entries(voucher_content)
+    inventory_entries = extract_entries(fields, INVENTORY_FIELDS)
     
     # Check for accounting ledger entries
-    accounting_ledger_entries = extract_accounting_ledger_entries(voucher_content)
+    accounting_ledger_entries = extract_entries(fields, ACCOUNTING_FIELDS)
     
     return {
         'voucher_number': voucher_number,
@@ -102,78 +211,21 @@ def analyze_single_voucher(voucher_content: str, voucher_number: int) -> Dict[st
     }
 
 
-def extract_tag_value(content: str, tag_name: str) -> str:
-    """Extract value from a specific tag."""
-    pattern = f'<{tag_name}>([^<]*)</{tag_name}>'
-    match = re.search(pattern, content)
-    return match.group(1).strip() if match else ''
+def extract_tag_value(fields: Dict[str, List[str]], tag_name: str) -> str:
+    """Return the first value of a tag in the voucher."""
+    values = fields.get(tag_name)
+    return values[0] if values else ''
 
 
-def extract_ledger_entries(voucher_content: str) -> List[Dict[str, str]]:
-    """Extract all ledger entries from voucher."""
+def extract_entries(fields: Dict[str, List[str]], tag_keys: List[Tuple[str, str]]) -> List[Dict[str, str]]:
+    """Collect one entry from the first value of each tag, stored under its entry key."""
     entries = []
     
-    # Find all ledger-related tags
-    ledger_tags = [
-        'TRN_LEDGERENTRIES_AMOUNT',
-        'TRN_LEDGERENTRIES_ID', 
-        'TRN_LEDGERENTRIES_IS_DEBIT',
-        'TRN_LEDGERENTRIES_LEDGER_NAME'
-    ]
-    
     entry = {}
-    for tag in ledger_tags:
-        value = extract_tag_value(voucher_content, tag)
-        if value:
-            entry[tag.replace('TRN_LEDGERENTRIES_', '').lower()] = value
-    
-    if entry:
-        entries.append(entry)
-    
-    return entries
-
-
-def extract_inventory_entries(voucher_content: str) -> List[Dict[str, str]]:
-    """Extract all inventory entries from voucher."""
-    entries = []
-    
-    # Find all inventory-related tags
-    inventory_tags = [
-        'TRN_INVENTORYENTRIES_AMOUNT',
-        'TRN_INVENTORYENTRIES_ID',
-        'TRN_INVENTORYENTRIES_QUANTITY',
-        'TRN_INVENTORYENTRIES_RATE',
-        'TRN_INVENTORYENTRIES_STOCKITEM_NAME'
-    ]
-    
-    entry = {}
-    for tag in inventory_tags:
-        value = extract_tag_value(voucher_content, tag)
-        if value:
-            entry[tag.replace('TRN_INVENTORYENTRIES_', '').lower()] = value
-    
-    if entry:
-        entries.append(entry)
-    
-    return entries
-
-
-def extract_accounting_ledger_entries(voucher_content: str) -> List[Dict[str, str]]:
-    """Extract all accounting ledger entries from voucher."""
-    entries = []
-    
-    # Find all accounting ledger-related tags
-    accounting_tags = [
-        'TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_NAME',
-        'TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_AMOUNT',
-        'TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_ISDEEMEDPOSITIVE'
-    ]
-    
-    entry = {}
-    for tag in accounting_tags:
-        value = extract_tag_value(voucher_content, tag)
-        if value:
-            entry[tag.replace('TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_', '').lower()] = value
+    for tag, key in tag_keys:
+        values = fields.get(tag)
+        if values and values[0]:
+            entry[key] = values[0]
     
     if entry:
         entries.append(entry)
@@ -184,52 +236,57 @@ def extract_accounting_ledger_entries(voucher_content: str) -> List[Dict[str, st
 def print_detailed_analysis(analysis: Dict[str, Any]) -> None:
     """Print detailed analysis results."""
     
-    print("=" * 80)
-    print("DETAILED TALLY XML STRUCTURE ANALYSIS")
-    print("=" * 80)
+    # Build the report and write it once instead of a print per line
+    lines = []
+    
+    lines.append("=" * 80)
+    lines.append("DETAILED TALLY XML STRUCTURE ANALYSIS")
+    lines.append("=" * 80)
     
-    print(f"\n📊 OVERALL STATISTICS:")
-    print(f"  Total Vouchers: {analysis['total_vouchers']}")
-    print(f"  Vouchers with Inventory Items: {analysis['vouchers_with_inventory']}")
-    print(f"  Vouchers without Inventory Items: {analysis['vouchers_without_inventory']}")
+    lines.append(f"\n📊 OVERALL STATISTICS:")
+    lines.append(f"  Total Vouchers: {analysis['total_vouchers']}")
+    lines.append(f"  Vouchers with Inventory Items: {analysis['vouchers_with_inventory']}")
+    lines.append(f"  Vouchers without Inventory Items: {analysis['vouchers_without_inventory']}")
     
-    print(f"\n🏷️  LEDGER ENTRY PATTERNS:")
-    for pattern, count in analysis['ledger_entry_patterns'].items():
-        print(f"  {pattern}: {count} vouchers")
+    lines.append(f"\n🏷️  LEDGER ENTRY PATTERNS:")
+    for entry_count, count in analysis['ledger_entry_patterns'].items():
+        lines.append(f"  {entry_count}_ledger_entries: {count} vouchers")
     
-    print(f"\n📦 INVENTORY ENTRY PATTERNS:")
-    for pattern, count in analysis['inventory_entry_patterns'].items():
-        print(f"  {pattern}: {count} vouchers")
+    lines.append(f"\n📦 INVENTORY ENTRY PATTERNS:")
+    for entry_count, count in analysis['inventory_entry_patterns'].items():
+        lines.append(f"  {entry_count}_inventory_entries: {count} vouchers")
     
-    print(f"\n🔍 SAMPLE VOUCHER STRUCTURES:")
-    print("-" * 80)
+    lines.append(f"\n🔍 SAMPLE VOUCHER STRUCTURES:")
+    lines.append("-" * 80)
     
     for voucher in analysis['sample_vouchers']:
-        print(f"\nVoucher #{voucher['voucher_number']}:")
-        print(f"  ID: {voucher['voucher_id']}")
-        print(f"  Amount: {voucher['voucher_amount']}")
-        print(f"  Date: {voucher['voucher_date']}")
-        print(f"  Type: {voucher['voucher_type']}")
-        print(f"  Narration: {voucher['voucher_narration'][:50]}...")
+        lines.append(f"\nVoucher #{voucher['voucher_number']}:")
+        lines.append(f"  ID: {voucher['voucher_id']}")
+        lines.append(f"  Amount: {voucher['voucher_amount']}")
+        lines.append(f"  Date: {voucher['voucher_date']}")
+        lines.append(f"  Type: {voucher['voucher_type']}")
+        lines.append(f"  Narration: {voucher['voucher_narration'][:50]}...")
         
-        print(f"  Ledger Entries ({voucher['total_ledger_entries']}):")
+        lines.append(f"  Ledger Entries ({voucher['total_ledger_entries']}):")
         for entry in voucher['ledger_entries']:
-            print(f"    - Ledger Name: {entry.get('ledger_name', 'N/A')}")
-            print(f"    - Amount: {entry.get('amount', 'N/A')}")
-            print(f"    - ID: {entry.get('id', 'N/A')}")
+            lines.append(f"    - Ledger Name: {entry.get('ledger_name', 'N/A')}")
+            lines.append(f"    - Amount: {entry.get('amount', 'N/A')}")
+            lines.append(f"    - ID: {entry.get('id', 'N/A')}")
         
-        print(f"  Inventory Entries ({voucher['total_inventory_entries']}):")
+        lines.append(f"  Inventory Entries ({voucher['total_inventory_entries']}):")
         for entry in voucher['inventory_entries']:
-            print(f"    - Stock Item: {entry.get('stockitem_name', 'N/A')}")
-            print(f"    - Amount: {entry.get('amount', 'N/A')}")
-            print(f"    - Quantity: {entry.get('quantity', 'N/A')}")
-            print(f"    - Rate: {entry.get('rate', 'N/A')}")
+            lines.append(f"    - Stock Item: {entry.get('stockitem_name', 'N/A')}")
+            lines.append(f"    - Amount: {entry.get('amount', 'N/A')}")
+            lines.append(f"    - Quantity: {entry.get('quantity', 'N/A')}")
+            lines.append(f"    - Rate: {entry.get('rate', 'N/A')}")
         
-        print(f"  Accounting Ledger Entries ({voucher['total_accounting_ledger_entries']}):")
+        lines.append(f"  Accounting Ledger Entries ({voucher['total_accounting_ledger_entries']}):")
         for entry in voucher['accounting_ledger_entries']:
-            print(f"    - Name: {entry.get('name', 'N/A')}")
-            print(f"    - Amount: {entry.get('amount', 'N/A')}")
-            print(f"    - Is Positive: {entry.get('isdeemedpositive', 'N/A')}")
+            lines.append(f"    - Name: {entry.get('name', 'N/A')}")
+            lines.append(f"    - Amount: {entry.get('amount', 'N/A')}")
+            lines.append(f"    - Is Positive: {entry.get('isdeemedpositive', 'N/A')}")
+    
+    print('\n'.join(lines))
 
 
 if __name__ == "__main__":
@@ -4,31 +4,48 @@ Extended Master Data Migration
 Extract all master data types from Tally including godowns, stock categories, stock groups, units, cost categories, cost centres
 """
 
+import csv
+import io
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 import re
-import time
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from supabase_manager import SupabaseManager
 from config_manager import config
 from tally_client import TallyClient
+from xml_stream import iter_elements
+
+try:
+    from lxml import etree
+except ImportError:  # Optional: without lxml records are parsed with ElementTree
+    etree = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
-class ExtendedMasterMigration:
-    def __init__(self):
-        self.tally_client = TallyClient()
-        self.supabase_manager = SupabaseManager()
-        self.company_id = config.get_company_id()
-        self.division_id = config.get_division_id()
-
-    def create_tdl(self, master_type: str) -> str:
-        """Create TDL for specific master data type."""
-        company_name = config.get_tally_company_name()
-
-        tdl_xml = f"""<ENVELOPE>
+# master_type -> (table, record columns, columns refreshed on conflict)
+MASTER_TABLES = {
+    'GoDown': ('godowns', ('guid', 'name'), ('name',)),
+    'StockCategory': ('stock_categories', ('guid', 'name', 'alias', 'description'), ('name', 'alias', 'description')),
+    'StockGroup': ('stock_groups', ('guid', 'name', 'alias', 'description'), ('name', 'alias', 'description')),
+    'Unit': ('units_of_measure', ('guid', 'name'), ('name',)),
+    'CostCategory': ('cost_categories', ('guid', 'name', 'alias', 'description'), ('name', 'alias', 'description')),
+    'CostCentre': ('cost_centres', ('guid', 'name'), ('name',)),
+}
+
+def _upsert_sql(table: str, columns: tuple, update_columns: tuple) -> str:
+    """Build the execute_values upsert for a master table."""
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+    return f'''
+        INSERT INTO {table} ({', '.join(columns)}, company_id, division_id)
+        VALUES %s
+        ON CONFLICT (guid) DO UPDATE SET {updates}
+    '''
+
+# TDL export request, filled in per master type by create_tdl
+TDL_TEMPLATE = """<ENVELOPE>
     <HEADER>
         <VERSION>1</VERSION>
         <TALLYREQUEST>Export</TALLYREQUEST>
@@ -76,142 +93,172 @@ class ExtendedMasterMigration:
         </DESC>
     </BODY>
 </ENVELOPE>"""
+
+# Tally escapes neither control-character references nor bare ampersands
+CHAR_REF_RE = re.compile(r'&#[0-9]+;')
+BARE_AMPERSAND_RE = re.compile(r'&(?![a-zA-Z0-9#]+;)')
+
+# Tally field tag -> record key
+MASTER_FIELDS = {
+    'MASTER_GUID': 'guid',
+    'MASTER_NAME': 'name',
+    'MASTER_ALIAS': 'alias',
+    'MASTER_PARENT': 'parent',
+    'MASTER_DESCRIPTION': 'description',
+}
+MASTER_RECORD_DEFAULTS = {field: '' for field in MASTER_FIELDS.values()}
+
+def _staged_upsert_sql(table: str, columns: tuple, update_columns: tuple) -> tuple:
+    """Build the staging-table DDL, COPY and merge statements for a master table."""
+    staging = f"{table}_staging"
+    column_list = ', '.join(columns)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+    # Typed like the target's columns but without its constraints; dropped at commit
+    create_sql = f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA"
+    copy_sql = f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+    merge_sql = f'''
+        INSERT INTO {table} ({column_list}, company_id, division_id)
+        SELECT {column_list}, %s, %s FROM {staging}
+        ON CONFLICT (guid) DO UPDATE SET {updates}
+    '''
+    return create_sql, copy_sql, merge_sql
+
+# Built once at import: master_type -> (upsert SQL, record columns)
+MASTER_UPSERTS = {
+    master_type: (_upsert_sql(table, columns, update_columns), columns)
+    for master_type, (table, columns, update_columns) in MASTER_TABLES.items()
+}
+# master_type -> (create staging, COPY into staging, merge into target)
+MASTER_STAGED_UPSERTS = {
+    master_type: _staged_upsert_sql(table, columns, update_columns)
+    for master_type, (table, columns, update_columns) in MASTER_TABLES.items()
+}
+
+# Above this many records COPY through a staging table beats multi-row INSERTs
+COPY_THRESHOLD = 500
+
+def iter_master_fields(xml_content: str):
+    """Yield (tag, text) for each MASTER_* field element, in document order."""
+    if etree is not None:
+        # lxml filters on the field tags in C, so only those reach Python; recover
+        # mode skips malformed markup instead of failing the whole master type
+        for _, elem in etree.iterparse(io.BytesIO(xml_content.encode('utf-8')), tag=tuple(MASTER_FIELDS),
+                                       encoding='utf-8', recover=True, huge_tree=True):
+            yield elem.tag, elem.text
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return
+
+    for tag, text in iter_elements(ET.iterparse(io.StringIO(xml_content), events=('start', 'end'))):
+        if tag in MASTER_FIELDS:
+            yield tag, text
+
+class ExtendedMasterMigration:
+    def __init__(self):
+        self.tally_client = TallyClient()
+        self.supabase_manager = SupabaseManager()
+        self.company_id = config.get_company_id()
+        self.division_id = config.get_division_id()
+
+    def create_tdl(self, master_type: str) -> str:
+        """Create TDL for specific master data type."""
+        company_name = config.get_tally_company_name()
+
+        tdl_xml = TDL_TEMPLATE.format(master_type=master_type, company_name=company_name)
         return tdl_xml
 
     def parse_records(self, xml_content: str) -> list:
         """Parse XML content into records."""
         records = []
 
-        # Clean XML
-        cleaned_content = re.sub(r'&#[0-9]+;', '', xml_content)
-        cleaned_content = re.sub(r'&(?![a-zA-Z0-9#]+;)', '&amp;', cleaned_content)
-
-        # Parse XML
-        root = ET.fromstring(cleaned_content)
-
-        # Parse records
-        guid = None
-        name = None
-        alias = None
-        parent = None
-        description = None
-
-        for elem in root.iter():
-            if elem.tag == 'MASTER_GUID':
-                # Save previous record if we have data
-                if guid and name:
-                    records.append({
-                        'guid': guid,
-                        'name': name,
-                        'alias': alias or '',
-                        'parent': parent or '',
-                        'description': description or ''
-                    })
-                # Start new record
-                guid = elem.text if elem.text else ''
-                name = None
-                alias = None
-                parent = None
-                description = None
-            elif elem.tag == 'MASTER_NAME':
-                name = elem.text if elem.text else ''
-            elif elem.tag == 'MASTER_ALIAS':
-                alias = elem.text if elem.text else ''
-            elif elem.tag == 'MASTER_PARENT':
-                parent = elem.text if elem.text else ''
-            elif elem.tag == 'MASTER_DESCRIPTION':
-                description = elem.text if elem.text else ''
-
-        # Add the last record
-        if guid and name:
-            records.append({
-                'guid': guid,
-                'name': name,
-                'alias': alias or '',
-                'parent': parent or '',
-                'description': description or ''
-            })
+        # Clean XML. lxml's recover mode would drop the text around a bare '&'
+        # rather than keep it, so ampersands are still escaped up front.
+        cleaned_content = CHAR_REF_RE.sub('', xml_content)
+        if '&' in cleaned_content:
+            cleaned_content = BARE_AMPERSAND_RE.sub('&amp;', cleaned_content)
+
+        # Parse records, streaming the XML and dropping each element once read.
+        # The TDL line export is flat (no per-record container), so a record
+        # starts at each MASTER_GUID and collects the fields that follow it.
+        record = None
+        for tag, text in iter_master_fields(cleaned_content):
+            field = MASTER_FIELDS[tag]
+            if field == 'guid':
+                if record is not None:
+                    records.append(record)
+                record = dict(MASTER_RECORD_DEFAULTS)
+            if record is not None:
+                record[field] = text or ''
+
+        if record is not None:
+            records.append(record)
+
+        # Only records that came with both a guid and a name are kept
+        records = [record for record in records if record['guid'] and record['name']]
 
         return records
 
     def migrate_master_type(self, master_type: str, records: list) -> bool:
-        """Migrate records to Supabase."""
-        if not self.supabase_manager.connect():
-            logger.error("❌ Failed to connect to Supabase")
-            return False
-
+        """Migrate records to Supabase over the connection opened by run_extended_migration."""
         try:
             cursor = self.supabase_manager.conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute('SET search_path TO tally, public')
 
-            success_count = 0
-            error_count = 0
-
-            for record in records:
-                try:
-                    if master_type == 'GoDown':
-                        cursor.execute('''
-                            INSERT INTO godowns (guid, name, company_id, division_id)
-                            VALUES (%s, %s, %s, %s)
-                            ON CONFLICT (guid) DO UPDATE SET name = EXCLUDED.name
-                        ''', (record['guid'], record['name'], self.company_id, self.division_id))
-                    elif master_type == 'StockCategory':
-                        cursor.execute('''
-                            INSERT INTO stock_categories (guid, name, alias, description, company_id, division_id)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (guid) DO UPDATE SET name = EXCLUDED.name, alias = EXCLUDED.alias, description = EXCLUDED.description
-                        ''', (record['guid'], record['name'], record['alias'], record['description'], self.company_id, self.division_id))
-                    elif master_type == 'StockGroup':
-                        cursor.execute('''
-                            INSERT INTO stock_groups (guid, name, alias, description, company_id, division_id)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (guid) DO UPDATE SET name = EXCLUDED.name, alias = EXCLUDED.alias, description = EXCLUDED.description
-                        ''', (record['guid'], record['name'], record['alias'], record['description'], self.company_id, self.division_id))
-                    elif master_type == 'Unit':
-                        cursor.execute('''
-                            INSERT INTO units_of_measure (guid, name, company_id, division_id)
-                            VALUES (%s, %s, %s, %s)
-                            ON CONFLICT (guid) DO UPDATE SET name = EXCLUDED.name
-                        ''', (record['guid'], record['name'], self.company_id, self.division_id))
-                    elif master_type == 'CostCategory':
-                        cursor.execute('''
-                            INSERT INTO cost_categories (guid, name, alias, description, company_id, division_id)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (guid) DO UPDATE SET name = EXCLUDED.name, alias = EXCLUDED.alias, description = EXCLUDED.description
-                        ''', (record['guid'], record['name'], record['alias'], record['description'], self.company_id, self.division_id))
-                    elif master_type == 'CostCentre':
-                        cursor.execute('''
-                            INSERT INTO cost_centres (guid, name, company_id, division_id)
-                            VALUES (%s, %s, %s, %s)
-                            ON CONFLICT (guid) DO UPDATE SET name = EXCLUDED.name
-                        ''', (record['guid'], record['name'], self.company_id, self.division_id))
-
-                    success_count += 1
-
-                except Exception as e:
-                    error_count += 1
-                    logger.warning(f"⚠️  Error inserting {master_type} {record['name']}: {e}")
+            sql, columns = MASTER_UPSERTS[master_type]
+
+            # Keyed on guid so a repeated record keeps its last values, as the per-row
+            # upserts did; ON CONFLICT cannot touch the same row twice in one statement
+            rows = list({
+                record['guid']: tuple(record[column] for column in columns)
+                for record in records
+            }.values())
+
+            if len(rows) > COPY_THRESHOLD:
+                self._copy_upsert(cursor, master_type, rows)
+            else:
+                # One multi-row INSERT per page instead of a round-trip per record
+                execute_values(cursor, sql, [row + (self.company_id, self.division_id) for row in rows], page_size=1000)
+            success_count = len(rows)
 
             self.supabase_manager.conn.commit()
-            logger.info(f"✅ {master_type} migrated: {success_count} success, {error_count} errors")
+            logger.info(f"✅ {master_type} migrated: {success_count} records")
 
-            self.supabase_manager.disconnect()
             return success_count > 0
 
         except Exception as e:
             logger.error(f"❌ Error migrating {master_type}: {e}")
             self.supabase_manager.conn.rollback()
-            self.supabase_manager.disconnect()
             return False
 
-    def migrate_master_data_type(self, master_type: str) -> bool:
-        """Migrate a specific master data type."""
-        logger.info(f"🔄 Migrating {master_type} data...")
+    def _copy_upsert(self, cursor, master_type: str, rows: list) -> None:
+        """COPY rows into a temp staging table, then upsert them with one INSERT ... SELECT."""
+        create_sql, copy_sql, merge_sql = MASTER_STAGED_UPSERTS[master_type]
+
+        buffer = io.StringIO()
+        # Quoting every value keeps empty strings from being read back as NULL
+        csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator='\n').writerows(rows)
+        buffer.seek(0)
 
-        tdl_xml = self.create_tdl(master_type)
+        cursor.execute(create_sql)
+        cursor.copy_expert(copy_sql, buffer)
+        cursor.execute(merge_sql, (self.company_id, self.division_id))
 
+    def fetch_master_data(self, master_type: str):
+        """Fetch the Tally export for a master data type, or None on failure."""
         try:
-            response = self.tally_client.send_tdl_request(tdl_xml)
+            return self.tally_client.send_tdl_request(self.create_tdl(master_type))
+        except Exception as e:
+            logger.error(f"❌ Error fetching {master_type} data: {e}")
+            return None
+
+    def migrate_master_data_type(self, master_type: str, response=None) -> bool:
+        """Migrate a specific master data type, fetching it first unless a response is given."""
+        logger.info(f"🔄 Migrating {master_type} data...")
+
+        try:
+            if response is None:
+                response = self.fetch_master_data(master_type)
             if not response:
                 logger.error(f"❌ No response from Tally for {master_type}")
                 return False
@@ -243,13 +290,25 @@ class ExtendedMasterMigration:
         # Additional master data types
         master_types = ['GoDown', 'StockCategory', 'StockGroup', 'Unit', 'CostCategory', 'CostCentre']
 
+        # The Tally fetches are independent HTTP calls, so run them side by side;
+        # parsing and DB writes stay sequential on the shared connection
+        with ThreadPoolExecutor(max_workers=len(master_types)) as executor:
+            futures = {master_type: executor.submit(self.fetch_master_data, master_type) for master_type in master_types}
+            responses = {master_type: future.result() for master_type, future in futures.items()}
+
+        # One connection for all six types instead of a connect/disconnect per type
+        if not self.supabase_manager.connect():
+            logger.error("❌ Failed to connect to Supabase")
+            return False
+
         results = {}
-        for master_type in master_types:
-            logger.info(f"🔄 Processing {master_type}...")
-            success = self.migrate_master_data_type(master_type)
-            results[master_type] = success
-            # Small delay between requests
-            time.sleep(3)
+        try:
+            for master_type in master_types:
+                logger.info(f"🔄 Processing {master_type}...")
+                success = self.migrate_master_data_type(master_type, responses[master_type] or '')
+                results[master_type] = success
+        finally:
+            self.supabase_manager.disconnect()
 
         # Summary
         success_count = sum(1 for success in results.values() if success)
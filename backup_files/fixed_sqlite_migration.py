@@ -5,78 +5,207 @@ Fixed SQLite Migration - Correctly parse the flat XML structure
 
 import argparse
 import logging
+import queue
 import sqlite3
+import threading
 import xml.etree.ElementTree as ET
 from decimal import Decimal
+from functools import lru_cache
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional, Tuple
 
 from config_manager import config
 from tally_client import TallyClient
+import xml_stream
+
+try:
+    from lxml import etree
+except ImportError:  # Optional: without lxml the response is parsed with ElementTree
+    etree = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+def _upsert_sql(table: str, columns: tuple) -> str:
+    """Build an insert that updates the existing row in place when its guid is already present."""
+    updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column != 'guid')
+    return f'''
+    INSERT INTO {table} ({', '.join(columns)})
+    VALUES ({', '.join('?' * len(columns))})
+    ON CONFLICT (guid) DO UPDATE SET {updates}
+'''
+
+# Prepared once per table and reused by executemany for every row. Unlike INSERT OR REPLACE,
+# a re-run updates rows in place instead of deleting and re-inserting them under a new id.
+VOUCHER_INSERT_SQL = _upsert_sql('vouchers', (
+    'guid', 'date', 'voucher_number', 'narration', 'amount', 'voucher_type', 'party_name',
+    'company_id', 'division_id',
+))
+LEDGER_ENTRY_INSERT_SQL = _upsert_sql('ledger_entries', (
+    'guid', 'voucher_id', 'ledger_name', 'amount', 'is_debit', 'company_id', 'division_id',
+))
+INVENTORY_ENTRY_INSERT_SQL = _upsert_sql('inventory_entries', (
+    'guid', 'voucher_id', 'stock_item_name', 'quantity', 'rate', 'amount', 'company_id', 'division_id',
+))
+
+# Thousands separators and spaces stripped from Tally amounts in a single pass
+_NO_COMMA = str.maketrans('', '', ', ')
+
+# Parsing and inserting overlap: the parser thread hands over batches of this many records
+INSERT_BATCH_SIZE = 1000
+INSERT_QUEUE_SIZE = 8
+
+# Tally month abbreviations, as in 1-Apr-24
+MONTH_MAP = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+# Characters handed to the pull parser at a time
+FEED_CHUNK_CHARS = 1 << 16
+
+# Tag prefix -> record kind for the flat voucher export
+RECORD_PREFIXES = (
+    ('VOUCHER_', 'vouchers'),
+    ('TRN_LEDGERENTRIES_', 'ledger_entries'),
+    ('TRN_INVENTORYENTRIES_', 'inventory_entries'),
+)
+
+@lru_cache(maxsize=4096)
+def convert_tally_date(date_str: str) -> Optional[str]:
+    """Convert a Tally date such as 1-Apr-24 to YYYY-MM-DD, or None if malformed.
+    
+    Cached because an export has far fewer distinct dates than vouchers.
+    """
+    try:
+        day, month_str, year = date_str.strip().split('-')
+        year = int(year)
+        year += 2000 if year < 50 else 1900
+        return f"{year:04d}-{MONTH_MAP[month_str]:02d}-{int(day):02d}"
+    except (ValueError, TypeError, KeyError):
+        return None
+
+@lru_cache(maxsize=None)
+def resolve_record_tag(tag: str) -> Optional[Tuple[str, str]]:
+    """Map a flat export tag to (record kind, field name), or None for unrelated tags."""
+    for prefix, kind in RECORD_PREFIXES:
+        if tag.startswith(prefix):
+            return kind, tag[len(prefix):].lower()
+    return None
+
+def iter_elements(xml_content: str):
+    """Yield (tag, text) for every element in document order, freeing each once read."""
+    if etree is not None:
+        # lxml builds its nodes in C; huge_tree lifts libxml2's limits for large exports
+        for _, elem in _pull_events(xml_content, etree.XMLPullParser(events=('end',), huge_tree=True)):
+            yield elem.tag, elem.text
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return
+    
+    yield from xml_stream.iter_elements(_pull_events(xml_content, ET.XMLPullParser(events=('start', 'end'))))
+
+def _pull_events(xml_content: str, parser):
+    """Yield the pull parser's events, feeding the response to it in slices."""
+    # Slicing avoids copying all of the response into a StringIO or an encoded bytes buffer
+    for offset in range(0, len(xml_content) + FEED_CHUNK_CHARS, FEED_CHUNK_CHARS):
+        chunk = xml_content[offset:offset + FEED_CHUNK_CHARS]
+        if chunk:
+            parser.feed(chunk)
+        else:
+            parser.close()
+        yield from parser.read_events()
+
 class FixedSQLiteMigration:
-    def __init__(self):
+    def __init__(self, fast: bool = False):
         self.tally_client = TallyClient()
         self.company_id = config.get_company_id()
         self.division_id = config.get_division_id()
         self.db_path = 'tally_fixed.db'
+        # Skip fsyncs entirely; a crash mid-load can corrupt the DB, so only for throwaway runs
+        self.fast = fast
+        # One connection shared by the schema, insert and query phases; see _connect/close
+        self._conn = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Return the shared SQLite connection, opening it with bulk-load pragmas on first use."""
+        if self._conn is None:
+            # Transactions are opened explicitly; keep plenty of prepared statements around
+            conn = sqlite3.connect(self.db_path, isolation_level=None, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f"PRAGMA synchronous={'OFF' if self.fast else 'NORMAL'}")
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-65536')  # 64 MB
+            conn.execute('PRAGMA mmap_size=268435456')  # 256 MB
+            self._conn = conn
+        return self._conn
+    
+    def close(self):
+        """Close the shared SQLite connection, if open."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
         
     def safe_decimal(self, value: str) -> Optional[float]:
         """Convert string to decimal, handling commas and empty values."""
-        if not value or value.strip() == '':
+        if not value:
             return None
         try:
-            cleaned_value = str(value).replace(',', '').strip()
-            if cleaned_value == '':
-                return None
-            return float(cleaned_value)
-        except (ValueError, TypeError):
+            # A blank value translates to '' and fails float() like any other junk
+            return float(value.translate(_NO_COMMA))
+        except (ValueError, TypeError, AttributeError):
             return None
     
     def safe_date(self, date_str: str) -> Optional[str]:
         """Convert Tally date format to PostgreSQL date format."""
-        if not date_str or date_str.strip() == '':
-            return None
-        try:
-            parts = date_str.strip().split('-')
-            if len(parts) != 3:
-                return None
-            
-            day = int(parts[0])
-            month_str = parts[1]
-            year = int(parts[2])
-            
-            if year < 50:
-                year += 2000
-            else:
-                year += 1900
-            
-            month_map = {
-                'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
-                'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
-            }
-            
-            month = month_map.get(month_str)
-            if not month:
-                return None
-            
-            return f"{year:04d}-{month:02d}-{day:02d}"
-        except (ValueError, TypeError, KeyError):
+        if not date_str:
             return None
+        return convert_tally_date(date_str)
     
-    def create_sqlite_schema(self):
-        """Create simple SQLite schema for testing."""
-        conn = sqlite3.connect(self.db_path)
+    def _check_existing_schema(self, cursor: sqlite3.Cursor) -> bool:
+        """Return False if existing entry tables still link voucher_id to vouchers(id).
+        
+        CREATE TABLE IF NOT EXISTS leaves tables from an older database untouched, so check them.
+        """
+        outdated_tables = []
+        for table in ('ledger_entries', 'inventory_entries'):
+            column_types = {row[1]: row[2] for row in cursor.execute(f'PRAGMA table_info({table})')}
+            if not column_types:
+                continue
+            # foreign_key_list rows are (id, seq, table, from, to, ...)
+            references = {row[2:5] for row in cursor.execute(f'PRAGMA foreign_key_list({table})')}
+            if (column_types.get('voucher_id', '').upper() != 'TEXT'
+                    or ('vouchers', 'voucher_id', 'guid') not in references):
+                outdated_tables.append(table)
+        
+        if outdated_tables:
+            logger.error(f"❌ {self.db_path} has an outdated schema: {', '.join(outdated_tables)} "
+                         f"link voucher_id to vouchers(id) instead of vouchers(guid). "
+                         f"Delete or rename {self.db_path} and run the migration again to recreate it.")
+            return False
+        
+        # Tables created with AUTOINCREMENT still work; they just keep the slower rowid allocation
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'")
+        autoincrement_tables = [row[0] for row in cursor.fetchall()]
+        if autoincrement_tables:
+            logger.warning(f"⚠️  {', '.join(autoincrement_tables)} in {self.db_path} still use AUTOINCREMENT; "
+                           f"recreate the database to drop it")
+        return True
+    
+    def create_sqlite_schema(self, conn: Optional[sqlite3.Connection] = None) -> bool:
+        """Create simple SQLite schema for testing; returns False if an outdated schema is in the way."""
+        conn = conn or self._connect()
         cursor = conn.cursor()
         
+        if not self._check_existing_schema(cursor):
+            return False
+        
         # Create vouchers table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS vouchers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 guid TEXT UNIQUE NOT NULL,
                 date TEXT,
                 voucher_number TEXT,
@@ -93,25 +222,25 @@ class FixedSQLiteMigration:
         # Create ledger_entries table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS ledger_entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 guid TEXT UNIQUE NOT NULL,
-                voucher_id INTEGER,
+                voucher_id TEXT,
                 ledger_name TEXT,
                 amount REAL,
                 is_debit BOOLEAN,
                 company_id TEXT,
                 division_id TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (voucher_id) REFERENCES vouchers(id)
+                FOREIGN KEY (voucher_id) REFERENCES vouchers(guid)
             )
         ''')
         
         # Create inventory_entries table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS inventory_entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 guid TEXT UNIQUE NOT NULL,
-                voucher_id INTEGER,
+                voucher_id TEXT,
                 stock_item_name TEXT,
                 quantity REAL,
                 rate REAL,
@@ -119,100 +248,88 @@ class FixedSQLiteMigration:
                 company_id TEXT,
                 division_id TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (voucher_id) REFERENCES vouchers(id)
+                FOREIGN KEY (voucher_id) REFERENCES vouchers(guid)
             )
         ''')
         
+        # Per-company lookups of a voucher by guid
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_vouchers_company_division_guid
+            ON vouchers (company_id, division_id, guid)
+        ''')
+        
+        # Entries are looked up and joined by their parent voucher's guid
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_voucher ON ledger_entries (voucher_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventory_voucher ON inventory_entries (voucher_id)')
+        
         conn.commit()
-        conn.close()
         logger.info("✅ SQLite schema created successfully")
+        return True
+    
+    def iter_flat_records(self, xml_content: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (kind, record) for each voucher, ledger entry and inventory entry as it is parsed.
+        
+        A record whose ID was seen before is merged into the earlier one and yielded again.
+        """
+        # The XML structure is flat - all elements are siblings. Each voucher,
+        # ledger entry and inventory entry is a run of consecutive fields, and a
+        # new run starts when a field repeats. Runs are grouped by their *_ID value.
+        records = {kind: {} for _, kind in RECORD_PREFIXES}
+        current = {kind: {} for _, kind in RECORD_PREFIXES}
+        voucher_id = None
+        
+        def flush(kind):
+            fields = current[kind]
+            current[kind] = {}
+            record_id = fields.get('id')
+            if not record_id:
+                return None
+            # The run's own dict becomes the record; only repeated IDs are merged
+            existing = records[kind].get(record_id)
+            if existing is None:
+                records[kind][record_id] = fields
+                return fields
+            existing.update(fields)
+            return existing
+        
+        # Stream the response in a single pass, dropping each element once read
+        for tag, text in iter_elements(xml_content):
+            resolved = resolve_record_tag(tag)
+            if resolved is None:
+                continue
+            
+            kind, field = resolved
+            run = current[kind]
+            if field in run:
+                record = flush(kind)
+                if record is not None:
+                    yield kind, record
+                run = current[kind]
+            if not run and kind != 'vouchers':
+                # Entries follow their voucher's fields, so the last VOUCHER_ID seen is their parent
+                run['parent_voucher_id'] = voucher_id
+            run[field] = text
+            if kind == 'vouchers' and field == 'id':
+                voucher_id = text
+        
+        for _, kind in RECORD_PREFIXES:
+            record = flush(kind)
+            if record is not None:
+                yield kind, record
     
     def parse_flat_xml_structure(self, xml_content: str) -> Dict[str, List[Dict[str, Any]]]:
         """Parse the flat XML structure correctly."""
         logger.info("🔄 Parsing flat XML structure...")
         
-        # Parse the XML response
-        root = ET.fromstring(xml_content)
-        
-        # The XML structure is flat - all elements are siblings
-        # We need to group them by voucher using VOUCHER_ID as the key
-        vouchers = {}
-        ledger_entries = {}
-        inventory_entries = {}
-        
-        # Process all elements
-        for elem in root.iter():
-            if elem.tag.startswith('VOUCHER_'):
-                tag_name = elem.tag.replace('VOUCHER_', '').lower()
-                
-                # Get the voucher ID from VOUCHER_ID element
-                if elem.tag == 'VOUCHER_ID':
-                    voucher_id = elem.text
-                    if voucher_id not in vouchers:
-                        vouchers[voucher_id] = {}
-                    vouchers[voucher_id]['id'] = voucher_id
-                else:
-                    # Find the voucher ID for this element by looking backwards
-                    voucher_id = None
-                    for sibling in root.iter():
-                        if sibling.tag == 'VOUCHER_ID':
-                            voucher_id = sibling.text
-                            break
-                    
-                    if voucher_id:
-                        if voucher_id not in vouchers:
-                            vouchers[voucher_id] = {}
-                        vouchers[voucher_id][tag_name] = elem.text
-            
-            elif elem.tag.startswith('TRN_LEDGERENTRIES_'):
-                tag_name = elem.tag.replace('TRN_LEDGERENTRIES_', '').lower()
-                
-                # Get the ledger entry ID
-                if elem.tag == 'TRN_LEDGERENTRIES_ID':
-                    ledger_id = elem.text
-                    if ledger_id not in ledger_entries:
-                        ledger_entries[ledger_id] = {}
-                    ledger_entries[ledger_id]['id'] = ledger_id
-                else:
-                    # Find the ledger entry ID for this element
-                    ledger_id = None
-                    for sibling in root.iter():
-                        if sibling.tag == 'TRN_LEDGERENTRIES_ID':
-                            ledger_id = sibling.text
-                            break
-                    
-                    if ledger_id:
-                        if ledger_id not in ledger_entries:
-                            ledger_entries[ledger_id] = {}
-                        ledger_entries[ledger_id][tag_name] = elem.text
-            
-            elif elem.tag.startswith('TRN_INVENTORYENTRIES_'):
-                tag_name = elem.tag.replace('TRN_INVENTORYENTRIES_', '').lower()
-                
-                # Get the inventory entry ID
-                if elem.tag == 'TRN_INVENTORYENTRIES_ID':
-                    inventory_id = elem.text
-                    if inventory_id not in inventory_entries:
-                        inventory_entries[inventory_id] = {}
-                    inventory_entries[inventory_id]['id'] = inventory_id
-                else:
-                    # Find the inventory entry ID for this element
-                    inventory_id = None
-                    for sibling in root.iter():
-                        if sibling.tag == 'TRN_INVENTORYENTRIES_ID':
-                            inventory_id = sibling.text
-                            break
-                    
-                    if inventory_id:
-                        if inventory_id not in inventory_entries:
-                            inventory_entries[inventory_id] = {}
-                        inventory_entries[inventory_id][tag_name] = elem.text
+        records = {kind: {} for _, kind in RECORD_PREFIXES}
+        for kind, record in self.iter_flat_records(xml_content):
+            records[kind][record['id']] = record
         
         # Convert to lists
         data = {
-            'vouchers': list(vouchers.values()),
-            'ledger_entries': list(ledger_entries.values()),
-            'inventory_entries': list(inventory_entries.values())
+            'vouchers': list(records['vouchers'].values()),
+            'ledger_entries': list(records['ledger_entries'].values()),
+            'inventory_entries': list(records['inventory_entries'].values())
         }
         
         logger.info(f"📊 Parsed data: {len(data['vouchers'])} vouchers, {len(data['ledger_entries'])} ledger entries, {len(data['inventory_entries'])} inventory entries")
@@ -224,101 +341,154 @@ class FixedSQLiteMigration:
         
         return data
     
+    def fetch_tally_response(self) -> Optional[str]:
+        """Request the voucher export from Tally using the working TDL approach."""
+        tdl_xml = self.tally_client.create_comprehensive_tdl()
+        
+        try:
+            response = self.tally_client.send_tdl_request(tdl_xml)
+        except Exception as e:
+            logger.error(f"❌ Error extracting data from Tally: {e}")
+            return None
+        
+        if not response:
+            logger.error("❌ No response from Tally")
+            return None
+        
+        logger.info(f"✅ Received {len(response)} characters from Tally")
+        return response
+    
     def extract_data_from_tally(self) -> Dict[str, List[Dict[str, Any]]]:
         """Extract data from Tally using the working TDL approach."""
         logger.info("🔄 Extracting data from Tally...")
         
-        tdl_xml = self.tally_client.create_comprehensive_tdl()
+        response = self.fetch_tally_response()
+        if not response:
+            return {}
         
         try:
-            response = self.tally_client.send_tdl_request(tdl_xml)
-            if not response:
-                logger.error("❌ No response from Tally")
-                return {}
-            
-            logger.info(f"✅ Received {len(response)} characters from Tally")
-            
             # Parse the flat XML structure
-            data = self.parse_flat_xml_structure(response)
-            
-            return data
-            
+            return self.parse_flat_xml_structure(response)
         except Exception as e:
             logger.error(f"❌ Error extracting data from Tally: {e}")
             return {}
     
-    def insert_data_to_sqlite(self, data: Dict[str, List[Dict[str, Any]]]):
-        """Insert extracted data into SQLite."""
-        conn = sqlite3.connect(self.db_path)
+    def _insert_records(self, cursor: sqlite3.Cursor, kind: str, records: List[Dict[str, Any]]):
+        """executemany one kind of record: vouchers, ledger_entries or inventory_entries."""
+        # Bind the converters and ids to locals once, outside the per-row comprehensions
+        sd, sdate = self.safe_decimal, self.safe_date
+        cid, did = self.company_id, self.division_id
+        
+        if kind == 'vouchers':
+            cursor.executemany(VOUCHER_INSERT_SQL, [
+                (v.get('id'), sdate(v.get('date')), v.get('voucher_number'), v.get('narration'),
+                 sd(v.get('amount')), v.get('voucher_type'), v.get('party_name'), cid, did)
+                for v in records
+            ])
+        elif kind == 'ledger_entries':
+            cursor.executemany(LEDGER_ENTRY_INSERT_SQL, [
+                (le.get('id'), le.get('parent_voucher_id'), le.get('ledger_name'), sd(le.get('amount')),
+                 le.get('is_debit') == 'Yes', cid, did)
+                for le in records
+            ])
+        else:
+            cursor.executemany(INVENTORY_ENTRY_INSERT_SQL, [
+                (ie.get('id'), ie.get('parent_voucher_id'), ie.get('stockitem_name'), sd(ie.get('quantity')),
+                 sd(ie.get('rate')), sd(ie.get('amount')), cid, did)
+                for ie in records
+            ])
+    
+    def insert_data_to_sqlite(self, data: Dict[str, List[Dict[str, Any]]],
+                              conn: Optional[sqlite3.Connection] = None) -> bool:
+        """Insert records already parsed by extract_data_from_tally; True on success, like load_xml_to_sqlite."""
+        conn = conn or self._connect()
         cursor = conn.cursor()
         
         try:
-            # Insert vouchers
-            logger.info(f"🔄 Inserting {len(data.get('vouchers', []))} vouchers...")
-            for voucher_data in data.get('vouchers', []):
-                cursor.execute('''
-                    INSERT OR REPLACE INTO vouchers (
-                        guid, date, voucher_number, narration, amount, voucher_type, party_name, company_id, division_id
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    voucher_data.get('id'),
-                    self.safe_date(voucher_data.get('date')),
-                    voucher_data.get('voucher_number'),
-                    voucher_data.get('narration'),
-                    self.safe_decimal(voucher_data.get('amount')),
-                    voucher_data.get('voucher_type'),
-                    voucher_data.get('party_name'),
-                    self.company_id,
-                    self.division_id
-                ))
+            # One executemany per table, all inside a single explicit transaction
+            cursor.execute('BEGIN')
             
-            # Insert ledger entries
-            logger.info(f"🔄 Inserting {len(data.get('ledger_entries', []))} ledger entries...")
-            for ledger_data in data.get('ledger_entries', []):
-                cursor.execute('''
-                    INSERT OR REPLACE INTO ledger_entries (
-                        guid, voucher_id, ledger_name, amount, is_debit, company_id, division_id
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    ledger_data.get('id'),
-                    ledger_data.get('id'),  # Same as voucher ID in flat structure
-                    ledger_data.get('ledger_name'),
-                    self.safe_decimal(ledger_data.get('amount')),
-                    ledger_data.get('is_debit') == 'Yes',
-                    self.company_id,
-                    self.division_id
-                ))
-            
-            # Insert inventory entries
-            logger.info(f"🔄 Inserting {len(data.get('inventory_entries', []))} inventory entries...")
-            for inventory_data in data.get('inventory_entries', []):
-                cursor.execute('''
-                    INSERT OR REPLACE INTO inventory_entries (
-                        guid, voucher_id, stock_item_name, quantity, rate, amount, company_id, division_id
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    inventory_data.get('id'),
-                    inventory_data.get('id'),  # Same as voucher ID in flat structure
-                    inventory_data.get('stockitem_name'),
-                    self.safe_decimal(inventory_data.get('quantity')),
-                    self.safe_decimal(inventory_data.get('rate')),
-                    self.safe_decimal(inventory_data.get('amount')),
-                    self.company_id,
-                    self.division_id
-                ))
+            for _, kind in RECORD_PREFIXES:
+                records = data.get(kind, [])
+                logger.info(f"🔄 Inserting {len(records)} {kind.replace('_', ' ')}...")
+                self._insert_records(cursor, kind, records)
             
             conn.commit()
+            
             logger.info("✅ Data inserted into SQLite successfully")
+            return True
             
         except Exception as e:
             logger.error(f"❌ Error inserting data into SQLite: {e}")
             conn.rollback()
+            return False
+    
+    def load_xml_to_sqlite(self, xml_content: str, conn: Optional[sqlite3.Connection] = None) -> bool:
+        """Parse the export on a worker thread while this thread inserts its records in batches."""
+        logger.info("🔄 Parsing and inserting flat XML structure...")
+        
+        # Bounded, so a parser that runs ahead of the inserts can't buffer the whole export
+        batches = queue.Queue(maxsize=INSERT_QUEUE_SIZE)
+        parse_errors = []
+        
+        def produce():
+            pending = {kind: [] for _, kind in RECORD_PREFIXES}
+            try:
+                for kind, record in self.iter_flat_records(xml_content):
+                    batch = pending[kind]
+                    batch.append(record)
+                    if len(batch) >= INSERT_BATCH_SIZE:
+                        batches.put((kind, batch))
+                        pending[kind] = []
+                for kind, batch in pending.items():
+                    if batch:
+                        batches.put((kind, batch))
+            except Exception as e:
+                parse_errors.append(e)
+            finally:
+                batches.put(None)
+        
+        parser = threading.Thread(target=produce, name='tally-xml-parser', daemon=True)
+        conn = conn or self._connect()
+        cursor = conn.cursor()
+        counts = {kind: 0 for _, kind in RECORD_PREFIXES}
+        parsed_all = False
+        parser.start()
+        
+        try:
+            cursor.execute('BEGIN')
+            while True:
+                item = batches.get()
+                if item is None:
+                    parsed_all = True
+                    break
+                kind, batch = item
+                self._insert_records(cursor, kind, batch)
+                counts[kind] += len(batch)
+            
+            if parse_errors:
+                raise parse_errors[0]
+            
+            conn.commit()
+            # Merged records are inserted again, so these count upserts rather than distinct rows
+            logger.info(f"📊 Inserted {counts['vouchers']} vouchers, {counts['ledger_entries']} ledger entries, {counts['inventory_entries']} inventory entries")
+            logger.info("✅ Data inserted into SQLite successfully")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Error loading data into SQLite: {e}")
+            conn.rollback()
+            return False
         finally:
-            conn.close()
+            # Unblock the parser if the inserts stopped before it finished
+            if not parsed_all:
+                while batches.get() is not None:
+                    pass
+            parser.join()
     
-    def query_sqlite_data(self):
+    def query_sqlite_data(self, conn: Optional[sqlite3.Connection] = None):
         """Query and display the inserted data."""
-        conn = sqlite3.connect(self.db_path)
+        conn = conn or self._connect()
         cursor = conn.cursor()
         
         try:
@@ -360,39 +530,45 @@ class FixedSQLiteMigration:
             
         except Exception as e:
             logger.error(f"❌ Error querying SQLite data: {e}")
-        finally:
-            conn.close()
     
     def migrate_data(self):
         """Main migration function."""
         logger.info("🚀 Starting fixed SQLite migration...")
         
-        # Step 1: Create SQLite schema
-        self.create_sqlite_schema()
-        
-        # Step 2: Extract data from Tally
-        data = self.extract_data_from_tally()
-        if not data:
-            logger.error("❌ No data extracted from Tally")
-            return False
-        
-        # Step 3: Insert data into SQLite
-        self.insert_data_to_sqlite(data)
-        
-        # Step 4: Query and display the data
-        self.query_sqlite_data()
-        
-        logger.info("✅ Fixed SQLite migration completed!")
-        return True
+        try:
+            # Step 1: Create SQLite schema
+            if not self.create_sqlite_schema():
+                return False
+            
+            # Step 2: Extract data from Tally
+            logger.info("🔄 Extracting data from Tally...")
+            response = self.fetch_tally_response()
+            if not response:
+                logger.error("❌ No data extracted from Tally")
+                return False
+            
+            # Step 3: Parse and insert data into SQLite, overlapping the two
+            if not self.load_xml_to_sqlite(response):
+                return False
+            
+            # Step 4: Query and display the data
+            self.query_sqlite_data()
+            
+            logger.info("✅ Fixed SQLite migration completed!")
+            return True
+        finally:
+            self.close()
 
 def main():
     parser = argparse.ArgumentParser(description='Fixed SQLite Migration')
     parser.add_argument('--action', choices=['migrate', 'extract-only', 'query'], 
                        default='migrate', help='Action to perform')
+    parser.add_argument('--fast', action='store_true',
+                       help='Disable SQLite fsyncs for a faster, non-crash-safe bulk load')
     
     args = parser.parse_args()
     
-    migration = FixedSQLiteMigration()
+    migration = FixedSQLiteMigration(fast=args.fast)
     
     if args.action == 'extract-only':
         logger.info("🔄 Extracting data from Tally only...")
@@ -402,7 +578,10 @@ def main():
             logger.info(f"  - {data_type}: {len(records)} records")
     elif args.action == 'query':
         logger.info("🔄 Querying SQLite data...")
-        migration.query_sqlite_data()
+        try:
+            migration.query_sqlite_data()
+        finally:
+            migration.close()
     else:
         migration.migrate_data()
 
@@ -10,9 +10,21 @@ import csv
 import os
 import argparse
 import re
-from typing import Dict, List, Any, Optional
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Any, Optional
 from pathlib import Path
 
+from xml_stream import iter_elements
+
+# Each record starts at this tag and runs until the next one
+RECORD_DELIMITER = 'VOUCHER_AMOUNT'
+WRAPPER_TAGS = ('ENVELOPE', 'TALLYMESSAGE')
+
+# Compiled once for the regex fallback in _scan_records
+WRAPPER_OPEN_RE = re.compile(r'<\?xml[^>]*\?>|<TALLYMESSAGE[^>]*>|<ENVELOPE[^>]*>')
+RECORD_START = b'<VOUCHER_AMOUNT>'
+TAG_RE = re.compile(r'<([^>]+)>([^<]*)</\1>')
+
 
 class FlatXMLParser:
     """Parser for flat XML structures with VOUCHER_AMOUNT as record delimiter."""
@@ -28,6 +40,9 @@ class FlatXMLParser:
         self.xml_file_path = Path(xml_file_path)
         self.output_csv_path = output_csv_path or self._generate_output_path()
         self.records = []
+        # Field names in first-seen order (a dict used as an ordered set), for the CSV header
+        self._fieldnames = {}
+        self._record_source = self._iter_records
         
     def _generate_output_path(self) -> str:
         """Generate output CSV path based on input XML file."""
@@ -41,22 +56,14 @@ class FlatXMLParser:
             List of dictionaries containing the parsed records
         """
         try:
-            with open(self.xml_file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-            
-            # Remove XML declaration and root tags for easier parsing
-            content = self._clean_xml_content(content)
-            
-            # Split content into records based on VOUCHER_AMOUNT tags
-            records = self._split_into_records(content)
-            
-            # Parse each record
-            parsed_records = []
-            for i, record_content in enumerate(records):
-                if record_content.strip():
-                    record_data = self._parse_record(record_content, i + 1)
-                    if record_data:
-                        parsed_records.append(record_data)
+            self._fieldnames = {}
+            try:
+                parsed_records = list(self._iter_records())
+            except ET.ParseError as e:
+                # Tally exports are not always well-formed (e.g. bare '&'); fall back to scanning the text
+                print(f"XML is not well-formed ({e}), falling back to text scanning")
+                self._fieldnames = {}
+                parsed_records = list(self._scan_records())
             
             self.records = parsed_records
             print(f"Successfully parsed {len(parsed_records)} records from flat XML")
@@ -66,55 +73,85 @@ class FlatXMLParser:
             print(f"Error parsing flat XML file: {e}")
             raise
     
+    def _iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Stream the XML file, yielding a record for each VOUCHER_AMOUNT-delimited run of fields."""
+        record = None
+        record_number = 0
+        events = ET.iterparse(str(self.xml_file_path), events=('start', 'end'))
+        
+        # Only leaf elements carry field values; wrapper tags are skipped
+        for tag, text in iter_elements(events, leaves_only=True):
+            if tag in WRAPPER_TAGS:
+                continue
+            if tag == RECORD_DELIMITER:
+                if record is not None:
+                    yield record
+                record_number += 1
+                record = {'record_number': record_number}
+                self._fieldnames['record_number'] = None
+            if record is not None:
+                tag_name = tag.strip()
+                record[tag_name] = (text or '').strip()
+                self._fieldnames[tag_name] = None
+        
+        if record is None:
+            print("No VOUCHER_AMOUNT tags found in the XML")
+        else:
+            yield record
+    
+    def _scan_records(self) -> Iterator[Dict[str, Any]]:
+        """Regex fallback for _iter_records when the file is not well-formed XML."""
+        # Read raw bytes; each record is decoded on its own instead of the whole file at once
+        with open(self.xml_file_path, 'rb') as file:
+            content = file.read()
+        
+        # Parse each record
+        for i, record_content in enumerate(self._split_into_records(content)):
+            if record_content:
+                record_data = self._parse_record(record_content, i + 1)
+                if record_data:
+                    yield record_data
+    
     def _clean_xml_content(self, content: str) -> str:
         """Clean XML content by removing declaration and root tags."""
-        # Remove XML declaration
-        content = re.sub(r'<\?xml[^>]*\?>', '', content)
+        # Remove XML declaration and opening TALLYMESSAGE/ENVELOPE tags in one pass
+        content = WRAPPER_OPEN_RE.sub('', content)
         
-        # Remove TALLYMESSAGE and ENVELOPE tags
-        content = re.sub(r'<TALLYMESSAGE[^>]*>', '', content)
-        content = re.sub(r'</TALLYMESSAGE>', '', content)
-        content = re.sub(r'<ENVELOPE[^>]*>', '', content)
-        content = re.sub(r'</ENVELOPE>', '', content)
+        # Closing tags are literals, so no regex is needed
+        content = content.replace('</TALLYMESSAGE>', '').replace('</ENVELOPE>', '')
         
         return content.strip()
     
-    def _split_into_records(self, content: str) -> List[str]:
-        """Split content into individual records based on VOUCHER_AMOUNT tags."""
-        # Find all VOUCHER_AMOUNT positions
-        voucher_amount_pattern = r'<VOUCHER_AMOUNT>'
-        matches = list(re.finditer(voucher_amount_pattern, content))
-        
-        if not matches:
+    def _split_into_records(self, content: bytes) -> Iterator[str]:
+        """Yield each record's cleaned text, split on VOUCHER_AMOUNT tags."""
+        # The delimiter is a literal, so bytes.find does the search in C
+        start_pos = content.find(RECORD_START)
+        if start_pos == -1:
             print("No VOUCHER_AMOUNT tags found in the XML")
-            return []
-        
-        records = []
+            return
         
-        # Extract records between VOUCHER_AMOUNT tags
-        for i, match in enumerate(matches):
-            start_pos = match.start()
-            
+        # Slicing the memoryview does not copy; only each record's bytes are decoded
+        view = memoryview(content)
+        while start_pos != -1:
             # Find the end position (next VOUCHER_AMOUNT or end of content)
-            if i + 1 < len(matches):
-                end_pos = matches[i + 1].start()
-            else:
-                end_pos = len(content)
+            end_pos = content.find(RECORD_START, start_pos + len(RECORD_START))
+            record_bytes = view[start_pos:end_pos if end_pos != -1 else len(content)]
             
-            # Extract record content
-            record_content = content[start_pos:end_pos].strip()
-            if record_content:
-                records.append(record_content)
-        
-        return records
+            # Match text-mode reading, which would have normalized line endings
+            record_content = str(record_bytes, 'utf-8')
+            if '\r' in record_content:
+                record_content = record_content.replace('\r\n', '\n').replace('\r', '\n')
+            
+            yield self._clean_xml_content(record_content)
+            start_pos = end_pos
     
     def _parse_record(self, record_content: str, record_number: int) -> Dict[str, Any]:
         """Parse a single record into a dictionary."""
         record_data = {'record_number': record_number}
+        self._fieldnames['record_number'] = None
         
         # Extract all XML tags and their values
-        tag_pattern = r'<([^>]+)>([^<]*)</\1>'
-        matches = re.findall(tag_pattern, record_content)
+        matches = TAG_RE.findall(record_content)
         
         for tag_name, tag_value in matches:
             # Clean tag name and value
@@ -123,6 +160,7 @@ class FlatXMLParser:
             
             # Add to record data
             record_data[clean_tag_name] = clean_tag_value
+            self._fieldnames[clean_tag_name] = None
         
         return record_data
     
@@ -141,12 +179,8 @@ class FlatXMLParser:
         
         output_path = csv_path or self.output_csv_path
         
-        # Get all unique field names
-        all_fields = set()
-        for record in self.records:
-            all_fields.update(record.keys())
-        
-        fieldnames = sorted(list(all_fields))
+        # Field names were collected while parsing, in the order they first appeared
+        fieldnames = list(self._fieldnames)
         
         # Write to CSV
         with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
@@ -160,29 +194,78 @@ class FlatXMLParser:
         
         return output_path
     
-    def preview_records(self, num_records: int = 3) -> None:
-        """Preview the parsed records."""
-        if not self.records:
+    def stream_to_csv(self, csv_path: Optional[str] = None) -> str:
+        """
+        Convert the XML file to CSV without holding all records in memory.
+        
+        The file is parsed twice: once to collect the header's field names
+        and once to write the rows, so only one record is held at a time.
+        
+        Args:
+            csv_path: Path for the CSV file (optional)
+        
+        Returns:
+            Path to the saved CSV file
+        """
+        output_path = csv_path or self.output_csv_path
+        
+        # First pass: collect field names and settle which parser the file needs
+        self._fieldnames = {}
+        try:
+            record_count = sum(1 for _ in self._iter_records())
+            self._record_source = self._iter_records
+        except ET.ParseError as e:
+            # Tally exports are not always well-formed (e.g. bare '&'); fall back to scanning the text
+            print(f"XML is not well-formed ({e}), falling back to text scanning")
+            self._fieldnames = {}
+            record_count = sum(1 for _ in self._scan_records())
+            self._record_source = self._scan_records
+        
+        if not record_count:
+            raise ValueError("No records found in the XML file.")
+        
+        fieldnames = list(self._fieldnames)
+        
+        # Second pass: write rows as they are parsed
+        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(self.iter_records())
+        
+        print(f"Records saved to CSV: {output_path}")
+        print(f"Total records: {record_count}")
+        print(f"Total columns: {len(fieldnames)}")
+        
+        return output_path
+    
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Yield records one at a time using the parser stream_to_csv settled on."""
+        return self._record_source()
+    
+    def preview_records(self, num_records: int = 3, records: Optional[Iterable[Dict[str, Any]]] = None) -> None:
+        """Preview the parsed records, or the first of `records` if given."""
+        preview = self.records[:num_records] if records is None else list(islice(records, num_records))
+        if not preview:
             print("No records parsed yet.")
             return
         
-        print(f"\nRecords Preview (showing first {min(num_records, len(self.records))} records):")
+        print(f"\nRecords Preview (showing first {len(preview)} records):")
         print("=" * 80)
         
-        for i, record in enumerate(self.records[:num_records]):
+        for i, record in enumerate(preview):
             print(f"\nRecord {i + 1}:")
             print("-" * 40)
             for key, value in record.items():
                 if value and str(value).strip():  # Only show non-empty values
                     print(f"  {key}: {value}")
     
-    def get_field_summary(self) -> Dict[str, int]:
-        """Get summary of field usage across all records."""
-        if not self.records:
-            return {}
+    def get_field_summary(self, records: Optional[Iterable[Dict[str, Any]]] = None) -> Dict[str, int]:
+        """Get summary of field usage across all records, or across `records` if given."""
+        if records is None:
+            records = self.records
         
         field_counts = {}
-        for record in self.records:
+        for record in records:
             for field_name, field_value in record.items():
                 if field_name not in field_counts:
                     field_counts[field_name] = 0
@@ -191,9 +274,9 @@ class FlatXMLParser:
         
         return field_counts
     
-    def print_field_summary(self) -> None:
+    def print_field_summary(self, records: Optional[Iterable[Dict[str, Any]]] = None) -> None:
         """Print summary of field usage."""
-        field_counts = self.get_field_summary()
+        field_counts = self.get_field_summary(records)
         
         print(f"\nField Usage Summary:")
         print("=" * 50)
@@ -212,6 +295,8 @@ def main():
     parser.add_argument('-p', '--preview', action='store_true', help='Preview records before saving')
     parser.add_argument('--preview-records', type=int, default=3, help='Number of records to preview')
     parser.add_argument('-s', '--summary', action='store_true', help='Show field usage summary')
+    parser.add_argument('--stream', action='store_true',
+                       help='Write rows as they are parsed instead of holding all records in memory')
     
     args = parser.parse_args()
     
@@ -219,6 +304,18 @@ def main():
         # Initialize parser
         flat_parser = FlatXMLParser(args.xml_file, args.output)
         
+        if args.stream:
+            # Records are never stored; preview and summary each take their own pass
+            csv_path = flat_parser.stream_to_csv()
+            if args.summary:
+                flat_parser.print_field_summary(flat_parser.iter_records())
+            if args.preview:
+                flat_parser.preview_records(args.preview_records, flat_parser.iter_records())
+            print(f"\nConversion completed successfully!")
+            print(f"Input XML: {args.xml_file}")
+            print(f"Output CSV: {csv_path}")
+            return 0
+        
         # Parse flat XML
         records = flat_parser.parse_flat_xml()
         
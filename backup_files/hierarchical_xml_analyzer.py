@@ -6,10 +6,148 @@ particularly focusing on ledger entries and inventory entries within vouchers.
 """
 
 import xml.etree.ElementTree as ET
+import mmap
+import os
 import re
-from typing import Dict, List, Any, Optional
+import sys
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
 from pathlib import Path
-from collections import defaultdict
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+
+from xml_stream import iter_elements
+
+try:
+    from lxml import etree
+except ImportError:  # Optional: without lxml the file is parsed with ElementTree
+    etree = None
+
+# Each voucher starts at this tag and runs until the next one
+VOUCHER_BOUNDARY_TAG = 'VOUCHER_AMOUNT'
+WRAPPER_TAGS = ('ENVELOPE', 'TALLYMESSAGE')
+
+# Voucher-level fields copied onto each voucher's analysis
+VOUCHER_INFO_FIELDS = {
+    'VOUCHER_ID': 'voucher_id',
+    'VOUCHER_AMOUNT': 'voucher_amount',
+    'VOUCHER_DATE': 'voucher_date',
+    'VOUCHER_VOUCHER_TYPE': 'voucher_type',
+}
+
+# Entry tag prefix -> analysis list; the accounting prefix extends the inventory one, so it comes first
+ENTRY_CATEGORIES = (
+    ('TRN_LEDGERENTRIES_', 'ledger_entries'),
+    ('TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_', 'accounting_ledger_entries'),
+    ('TRN_INVENTORYENTRIES_', 'inventory_entries'),
+)
+
+# Entry tags whose non-empty values are collected per voucher, and the list they go in
+NAME_FIELDS = {
+    'TRN_LEDGERENTRIES_LEDGER_NAME': 'ledger_names',
+    'TRN_INVENTORYENTRIES_STOCKITEM_NAME': 'inventory_items',
+}
+
+# Compiled once for the regex fallback in _scan_vouchers, which splits the mapped bytes on VOUCHER_START
+VOUCHER_START = b'<VOUCHER_AMOUNT>'
+# WRAPPER_TAG_RE strips the declaration and every ENVELOPE/TALLYMESSAGE tag in a single pass
+WRAPPER_TAG_RE = re.compile(r'<\?xml[^>]*\?>|</?(?:TALLYMESSAGE|ENVELOPE)[^>]*>')
+# One findall per voucher; each class stops at the delimiter that follows it, so nothing backtracks.
+# The \1 backreference rules out DFA engines (RE2, Hyperscan), and none is needed.
+TAG_RE = re.compile(r'<([^>]+)>([^<]*)</\1>')
+
+# Distinct voucher tag sequences whose analysis plan is cached; exports repeat a few layouts
+VOUCHER_LAYOUT_CACHE_SIZE = 4096
+
+# Vouchers sent to a worker process per task when analyzing with more than one worker
+PARALLEL_CHUNK_SIZE = 1000
+
+# Raised by either parser for malformed XML; analyze_structure then scans the text instead
+PARSE_ERRORS = (ET.ParseError,) if etree is None else (ET.ParseError, etree.XMLSyntaxError)
+
+
+@lru_cache(maxsize=None)
+def categorize_tag(tag: str) -> Optional[str]:
+    """Map an entry tag to the analysis list it belongs in, or None for other tags.
+    
+    Cached because an export repeats the same few dozen tags in every voucher.
+    """
+    for prefix, category in ENTRY_CATEGORIES:
+        if tag.startswith(prefix):
+            return category
+    return None
+
+
+# Every tag classified so far, in first-seen order; a tag's index is its bit in a voucher's tag_mask
+TAG_NAMES: List[str] = []
+
+
+@lru_cache(maxsize=None)
+def classify_tag(tag: str) -> Tuple[int, Optional[str]]:
+    """Return the tag's presence bit and its entry category (see categorize_tag).
+    
+    Runs once per distinct tag; the cache makes later lookups a single dict hit.
+    """
+    TAG_NAMES.append(tag)
+    return 1 << (len(TAG_NAMES) - 1), categorize_tag(tag)
+
+
+@lru_cache(maxsize=VOUCHER_LAYOUT_CACHE_SIZE)
+def voucher_layout(tags: Tuple[str, ...]) -> Tuple[int, Tuple[Tuple[int, str, Optional[str], Optional[str]], ...]]:
+    """Work out, once per distinct tag sequence, what _analyze_voucher does with each field.
+    
+    Returns the voucher's tag_mask and (index, tag, category, key) for every field that is an
+    entry (key is its NAME_FIELDS list, if any) or voucher info (category None, key its info field).
+    """
+    tag_mask = 0
+    steps = []
+    for index, tag in enumerate(tags):
+        tag_bit, category = classify_tag(tag)
+        tag_mask |= tag_bit
+        if category is not None:
+            steps.append((index, tag, category, NAME_FIELDS.get(tag)))
+        elif tag in VOUCHER_INFO_FIELDS:
+            steps.append((index, tag, None, VOUCHER_INFO_FIELDS[tag]))
+    return tag_mask, tuple(steps)
+
+
+def tags_in_mask(tag_mask: int) -> Iterator[str]:
+    """Yield the tags whose bits are set in a tag_mask, in first-seen order."""
+    index = 0
+    while tag_mask:
+        if tag_mask & 1:
+            yield TAG_NAMES[index]
+        tag_mask >>= 1
+        index += 1
+
+
+def iter_leaf_elements(xml_file_path: str) -> Iterator[Tuple[str, str]]:
+    """Yield (tag, text) for every leaf element in document order, freeing each once read."""
+    with open(xml_file_path, 'rb') as source:
+        # The file is read front to back once, so let the kernel read ahead aggressively
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(source.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        yield from _iter_leaf_elements(source)
+
+
+def _iter_leaf_elements(source) -> Iterator[Tuple[str, str]]:
+    if etree is not None:
+        # lxml builds its nodes in C; huge_tree lifts libxml2's limits for large exports
+        intern = sys.intern
+        for _, elem in etree.iterparse(source, events=('end',), huge_tree=True):
+            # Earlier siblings are deleted below, but the last child stays until the parent ends
+            if len(elem) == 0:
+                # lxml returns a fresh string per .tag; interning shares the few dozen distinct tags
+                yield intern(elem.tag), elem.text or ''
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return
+    
+    for tag, text in iter_elements(ET.iterparse(source, events=('start', 'end')), leaves_only=True):
+        yield tag, text or ''
 
 
 class HierarchicalXMLAnalyzer:
@@ -23,20 +161,9 @@ class HierarchicalXMLAnalyzer:
             xml_file_path: Path to the input XML file
         """
         self.xml_file_path = Path(xml_file_path)
-        self.content = ""
-        self.vouchers = []
         self.analysis_results = {}
+        self.workers = 1  # Processes analyzing vouchers; 1 analyzes them in this process
         
-    def load_xml_content(self) -> None:
-        """Load XML content from file."""
-        try:
-            with open(self.xml_file_path, 'r', encoding='utf-8') as file:
-                self.content = file.read()
-            print(f"Successfully loaded XML file: {self.xml_file_path}")
-        except Exception as e:
-            print(f"Error loading XML file: {e}")
-            raise
-    
     def analyze_structure(self) -> Dict[str, Any]:
         """
         Analyze the hierarchical structure of the XML.
@@ -44,163 +171,186 @@ class HierarchicalXMLAnalyzer:
         Returns:
             Dictionary containing analysis results
         """
-        if not self.content:
-            raise ValueError("XML content not loaded. Call load_xml_content() first.")
-        
-        # Clean XML content
-        cleaned_content = self._clean_xml_content(self.content)
-        
-        # Split into vouchers
-        vouchers = self._split_into_vouchers(cleaned_content)
-        
-        # Analyze each voucher
-        voucher_analysis = []
-        for i, voucher_content in enumerate(vouchers):
-            if voucher_content.strip():
-                analysis = self._analyze_voucher(voucher_content, i + 1)
-                voucher_analysis.append(analysis)
-        
-        # Overall analysis
-        overall_analysis = self._analyze_overall_structure(voucher_analysis)
+        # Each voucher is analyzed and folded into the overall totals as it is parsed, then dropped
+        try:
+            overall_analysis, hierarchical_vouchers = self._analyze_all(self._iter_vouchers())
+        except PARSE_ERRORS as e:
+            # Tally exports are not always well-formed (e.g. bare '&'); fall back to scanning the text
+            print(f"XML is not well-formed ({e}), falling back to text scanning")
+            overall_analysis, hierarchical_vouchers = self._analyze_all(self._scan_vouchers())
         
         self.analysis_results = {
-            'total_vouchers': len(voucher_analysis),
-            'voucher_analysis': voucher_analysis,
+            'total_vouchers': overall_analysis['total_vouchers'],
+            'hierarchical_vouchers': hierarchical_vouchers,
             'overall_analysis': overall_analysis
         }
         
         return self.analysis_results
     
+    def _analyze_all(
+        self, vouchers: Iterable[List[Tuple[str, str]]]
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Analyze every voucher, in worker processes when self.workers > 1."""
+        if self.workers <= 1:
+            return self._analyze_overall_structure(self._analyze_vouchers(vouchers))
+        
+        # Parsing stays here; workers analyze chunks and return partial totals, merged in order.
+        # Only a few chunks are in flight at a time so the file is still streamed.
+        partials = []
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            first_number = 1
+            vouchers = iter(vouchers)
+            while True:
+                chunk = list(islice(vouchers, PARALLEL_CHUNK_SIZE))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_analyze_voucher_chunk, chunk, first_number))
+                first_number += len(chunk)
+                if len(pending) >= self.workers * 2:
+                    partials.append(pending.popleft().result())
+            partials.extend(future.result() for future in pending)
+        
+        return self._merge_overall_structures(partials)
+    
+    @classmethod
+    def _analyze_vouchers(
+        cls, vouchers: Iterable[List[Tuple[str, str]]], first_number: int = 1
+    ) -> Iterator[Dict[str, Any]]:
+        """Analyze each voucher's (tag, value) fields as it arrives."""
+        for i, fields in enumerate(vouchers, first_number):
+            yield cls._analyze_voucher(fields, i)
+    
+    def _iter_vouchers(self) -> Iterator[List[Tuple[str, str]]]:
+        """Stream the XML file once, yielding each voucher's leaf (tag, value) pairs in document order."""
+        fields = None
+        
+        # Only leaf elements carry values; wrapper tags are skipped
+        for tag, text in iter_leaf_elements(str(self.xml_file_path)):
+            if tag in WRAPPER_TAGS:
+                continue
+            if tag == VOUCHER_BOUNDARY_TAG:
+                if fields is not None:
+                    yield fields
+                fields = []
+            if fields is not None:
+                fields.append((tag, text))
+        
+        if fields is None:
+            print("No VOUCHER_AMOUNT tags found in the XML")
+        else:
+            yield fields
+    
+    def _scan_vouchers(self) -> Iterator[List[Tuple[str, str]]]:
+        """Regex fallback for _iter_vouchers when the file is not well-formed XML."""
+        with open(self.xml_file_path, 'rb') as file:
+            if not file.read(1):
+                print("No VOUCHER_AMOUNT tags found in the XML")
+                return
+            # Map the file instead of reading it so only one voucher at a time is decoded
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    content.madvise(mmap.MADV_SEQUENTIAL)
+                findall = TAG_RE.findall
+                for voucher_bytes in self._split_into_vouchers(content):
+                    # Normalise line endings the way reading the file in text mode did
+                    voucher_content = voucher_bytes.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+                    yield findall(self._clean_xml_content(voucher_content))
+    
     def _clean_xml_content(self, content: str) -> str:
         """Clean XML content by removing declaration and root tags."""
-        # Remove XML declaration
-        content = re.sub(r'<\?xml[^>]*\?>', '', content)
-        
-        # Remove TALLYMESSAGE and ENVELOPE tags
-        content = re.sub(r'<TALLYMESSAGE[^>]*>', '', content)
-        content = re.sub(r'</TALLYMESSAGE>', '', content)
-        content = re.sub(r'<ENVELOPE[^>]*>', '', content)
-        content = re.sub(r'</ENVELOPE>', '', content)
-        
-        return content.strip()
+        return WRAPPER_TAG_RE.sub('', content).strip()
     
-    def _split_into_vouchers(self, content: str) -> List[str]:
-        """Split content into individual vouchers based on VOUCHER_AMOUNT tags."""
-        voucher_amount_pattern = r'<VOUCHER_AMOUNT>'
-        matches = list(re.finditer(voucher_amount_pattern, content))
-        
-        if not matches:
+    def _split_into_vouchers(self, content) -> Iterator[bytes]:
+        """Yield each voucher's bytes, from its VOUCHER_AMOUNT tag up to the next one."""
+        start = content.find(VOUCHER_START)
+        if start == -1:
             print("No VOUCHER_AMOUNT tags found in the XML")
-            return []
-        
-        vouchers = []
-        
-        # Extract vouchers between VOUCHER_AMOUNT tags
-        for i, match in enumerate(matches):
-            start_pos = match.start()
-            
-            # Find the end position (next VOUCHER_AMOUNT or end of content)
-            if i + 1 < len(matches):
-                end_pos = matches[i + 1].start()
-            else:
-                end_pos = len(content)
-            
-            # Extract voucher content
-            voucher_content = content[start_pos:end_pos].strip()
-            if voucher_content:
-                vouchers.append(voucher_content)
+            return
         
-        return vouchers
+        while start != -1:
+            end = content.find(VOUCHER_START, start + len(VOUCHER_START))
+            yield content[start:end if end != -1 else len(content)]
+            start = end
     
-    def _analyze_voucher(self, voucher_content: str, voucher_number: int) -> Dict[str, Any]:
-        """Analyze a single voucher for hierarchical structure."""
+    @staticmethod
+    def _analyze_voucher(fields: List[Tuple[str, str]], voucher_number: int) -> Dict[str, Any]:
+        """Analyze a single voucher's (tag, value) fields for hierarchical structure."""
         analysis = {
             'voucher_number': voucher_number,
             'voucher_id': '',
             'voucher_amount': '',
             'voucher_date': '',
+            'voucher_type': '',
             'ledger_entries': [],
             'inventory_entries': [],
             'accounting_ledger_entries': [],
-            'total_tags': 0,
-            'unique_tag_types': set()
+            'ledger_names': [],
+            'inventory_items': [],
+            'total_tags': len(fields),
+            'tag_mask': 0
         }
         
-        # Extract basic voucher info
-        voucher_id_match = re.search(r'<VOUCHER_ID>([^<]*)</VOUCHER_ID>', voucher_content)
-        if voucher_id_match:
-            analysis['voucher_id'] = voucher_id_match.group(1)
-        
-        voucher_amount_match = re.search(r'<VOUCHER_AMOUNT>([^<]*)</VOUCHER_AMOUNT>', voucher_content)
-        if voucher_amount_match:
-            analysis['voucher_amount'] = voucher_amount_match.group(1)
+        # Vouchers repeat the same few tag sequences, so what to do with each field is looked up
+        # once per sequence; only entry and voucher info fields are visited here
+        tag_mask, steps = voucher_layout(tuple(map(itemgetter(0), fields)))
+        intern = sys.intern
         
-        voucher_date_match = re.search(r'<VOUCHER_DATE>([^<]*)</VOUCHER_DATE>', voucher_content)
-        if voucher_date_match:
-            analysis['voucher_date'] = voucher_date_match.group(1)
-        
-        # Extract all tags and their values
-        tag_pattern = r'<([^>]+)>([^<]*)</\1>'
-        matches = re.findall(tag_pattern, voucher_content)
-        
-        analysis['total_tags'] = len(matches)
-        
-        # Categorize tags
-        for tag_name, tag_value in matches:
-            analysis['unique_tag_types'].add(tag_name)
+        for index, tag_name, category, key in steps:
+            tag_value = fields[index][1]
             
-            # Categorize ledger entries
-            if tag_name.startswith('TRN_LEDGERENTRIES_'):
-                analysis['ledger_entries'].append({
-                    'tag': tag_name,
-                    'value': tag_value.strip()
-                })
+            # Extract basic voucher info
+            if category is None:
+                if not analysis[key]:
+                    analysis[key] = tag_value
+                continue
             
-            # Categorize inventory entries
-            elif tag_name.startswith('TRN_INVENTORYENTRIES_'):
-                analysis['inventory_entries'].append({
-                    'tag': tag_name,
-                    'value': tag_value.strip()
-                })
+            # Categorize ledger, accounting ledger and inventory entries
+            tag_value = tag_value.strip()
+            analysis[category].append({'tag': tag_name, 'value': tag_value})
             
-            # Categorize accounting ledger entries
-            elif tag_name.startswith('TRN_INVENTORYENTRIES_ACCOUNTINGLEDGER_'):
-                analysis['accounting_ledger_entries'].append({
-                    'tag': tag_name,
-                    'value': tag_value.strip()
-                })
+            # Names repeat across vouchers; interned, every kept voucher shares one copy of each
+            if key and tag_value:
+                analysis[key].append(intern(tag_value))
         
-        # Convert set to list for JSON serialization
-        analysis['unique_tag_types'] = list(analysis['unique_tag_types'])
+        analysis['tag_mask'] = tag_mask
         
         return analysis
     
-    def _analyze_overall_structure(self, voucher_analysis: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Analyze overall structure across all vouchers."""
+    @staticmethod
+    def _analyze_overall_structure(
+        voucher_analysis: Iterable[Dict[str, Any]]
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Analyze overall structure across all vouchers in one pass.
+        
+        Returns the overall analysis and the vouchers with multiple ledger or inventory entries.
+        """
+        hierarchical_vouchers = []
         overall = {
-            'total_vouchers': len(voucher_analysis),
+            'total_vouchers': 0,
             'vouchers_with_multiple_ledger_entries': 0,
             'vouchers_with_multiple_inventory_entries': 0,
             'vouchers_with_accounting_ledger_entries': 0,
             'unique_ledger_names': set(),
             'unique_inventory_items': set(),
-            'tag_frequency': defaultdict(int),
+            'tag_frequency': Counter(),
             'voucher_types': set(),
             'date_range': {'earliest': None, 'latest': None}
         }
         
+        # Vouchers share a handful of tag layouts, so count layouts and expand them to tags at the end
+        tag_mask_counts = Counter()
+        
         for voucher in voucher_analysis:
-            # Check for multiple ledger entries (same voucher ID with different ledger names)
-            ledger_names = [entry['value'] for entry in voucher['ledger_entries'] 
-                          if entry['tag'] == 'TRN_LEDGERENTRIES_LEDGER_NAME' and entry['value']]
+            overall['total_vouchers'] += 1
             
+            # Check for multiple ledger entries (same voucher ID with different ledger names)
+            ledger_names = voucher['ledger_names']
             if len(ledger_names) > 1:
                 overall['vouchers_with_multiple_ledger_entries'] += 1
             
             # Check for multiple inventory entries
-            inventory_items = [entry['value'] for entry in voucher['inventory_entries'] 
-                             if entry['tag'] == 'TRN_INVENTORYENTRIES_STOCKITEM_NAME' and entry['value']]
-            
+            inventory_items = voucher['inventory_items']
             if len(inventory_items) > 1:
                 overall['vouchers_with_multiple_inventory_entries'] += 1
             
@@ -212,15 +362,65 @@ class HierarchicalXMLAnalyzer:
             overall['unique_ledger_names'].update(ledger_names)
             overall['unique_inventory_items'].update(inventory_items)
             
-            # Count tag frequency
-            for tag_type in voucher['unique_tag_types']:
-                overall['tag_frequency'][tag_type] += 1
+            # Count tag frequency; each voucher counts once per tag it uses
+            tag_mask_counts[voucher['tag_mask']] += 1
             
             # Collect voucher types
-            voucher_type_match = re.search(r'<VOUCHER_VOUCHER_TYPE>([^<]*)</VOUCHER_VOUCHER_TYPE>', 
-                                         voucher.get('voucher_content', ''))
-            if voucher_type_match:
-                overall['voucher_types'].add(voucher_type_match.group(1))
+            if voucher['voucher_type']:
+                overall['voucher_types'].add(voucher['voucher_type'])
+            
+            # Keep only the vouchers find_hierarchical_vouchers reports
+            if len(ledger_names) > 1 or len(inventory_items) > 1:
+                hierarchical_vouchers.append({
+                    'voucher_number': voucher['voucher_number'],
+                    'voucher_id': voucher['voucher_id'],
+                    'voucher_amount': voucher['voucher_amount'],
+                    'voucher_date': voucher['voucher_date'],
+                    'ledger_names': ledger_names,
+                    'inventory_items': inventory_items,
+                    'total_ledger_entries': len(ledger_names),
+                    'total_inventory_entries': len(inventory_items)
+                })
+        
+        for tag_mask, count in tag_mask_counts.items():
+            for tag in tags_in_mask(tag_mask):
+                overall['tag_frequency'][tag] += count
+        
+        # Convert sets to lists for JSON serialization
+        overall['unique_ledger_names'] = list(overall['unique_ledger_names'])
+        overall['unique_inventory_items'] = list(overall['unique_inventory_items'])
+        overall['voucher_types'] = list(overall['voucher_types'])
+        overall['tag_frequency'] = dict(overall['tag_frequency'])
+        
+        return overall, hierarchical_vouchers
+    
+    @staticmethod
+    def _merge_overall_structures(
+        partials: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Combine the per-chunk results of _analyze_overall_structure, in voucher order."""
+        hierarchical_vouchers = []
+        overall = {
+            'total_vouchers': 0,
+            'vouchers_with_multiple_ledger_entries': 0,
+            'vouchers_with_multiple_inventory_entries': 0,
+            'vouchers_with_accounting_ledger_entries': 0,
+            'unique_ledger_names': set(),
+            'unique_inventory_items': set(),
+            'tag_frequency': Counter(),
+            'voucher_types': set(),
+            'date_range': {'earliest': None, 'latest': None}
+        }
+        
+        for partial, partial_hierarchical in partials:
+            for key in ('total_vouchers', 'vouchers_with_multiple_ledger_entries',
+                        'vouchers_with_multiple_inventory_entries', 'vouchers_with_accounting_ledger_entries'):
+                overall[key] += partial[key]
+            overall['unique_ledger_names'].update(partial['unique_ledger_names'])
+            overall['unique_inventory_items'].update(partial['unique_inventory_items'])
+            overall['tag_frequency'].update(partial['tag_frequency'])
+            overall['voucher_types'].update(partial['voucher_types'])
+            hierarchical_vouchers.extend(partial_hierarchical)
         
         # Convert sets to lists for JSON serialization
         overall['unique_ledger_names'] = list(overall['unique_ledger_names'])
@@ -228,7 +428,7 @@ class HierarchicalXMLAnalyzer:
         overall['voucher_types'] = list(overall['voucher_types'])
         overall['tag_frequency'] = dict(overall['tag_frequency'])
         
-        return overall
+        return overall, hierarchical_vouchers
     
     def print_analysis_summary(self) -> None:
         """Print a summary of the analysis."""
@@ -271,29 +471,8 @@ class HierarchicalXMLAnalyzer:
             print("No analysis results available. Run analyze_structure() first.")
             return []
         
-        hierarchical_vouchers = []
-        
-        for voucher in self.analysis_results['voucher_analysis']:
-            # Check if voucher has multiple ledger entries or inventory entries
-            ledger_names = [entry['value'] for entry in voucher['ledger_entries'] 
-                          if entry['tag'] == 'TRN_LEDGERENTRIES_LEDGER_NAME' and entry['value']]
-            
-            inventory_items = [entry['value'] for entry in voucher['inventory_entries'] 
-                             if entry['tag'] == 'TRN_INVENTORYENTRIES_STOCKITEM_NAME' and entry['value']]
-            
-            if len(ledger_names) > 1 or len(inventory_items) > 1:
-                hierarchical_vouchers.append({
-                    'voucher_number': voucher['voucher_number'],
-                    'voucher_id': voucher['voucher_id'],
-                    'voucher_amount': voucher['voucher_amount'],
-                    'voucher_date': voucher['voucher_date'],
-                    'ledger_names': ledger_names,
-                    'inventory_items': inventory_items,
-                    'total_ledger_entries': len(ledger_names),
-                    'total_inventory_entries': len(inventory_items)
-                })
-        
-        return hierarchical_vouchers
+        # Collected by _analyze_overall_structure while the vouchers were parsed
+        return self.analysis_results['hierarchical_vouchers']
     
     def print_hierarchical_vouchers(self, limit: int = 5) -> None:
         """Print vouchers with hierarchical structures."""
@@ -315,6 +494,14 @@ class HierarchicalXMLAnalyzer:
                 print(f"    - {item}")
 
 
+def _analyze_voucher_chunk(
+    chunk: List[List[Tuple[str, str]]], first_number: int
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Worker-process entry point: analyze a chunk of vouchers into partial totals."""
+    return HierarchicalXMLAnalyzer._analyze_overall_structure(
+        HierarchicalXMLAnalyzer._analyze_vouchers(chunk, first_number))
+
+
 def main():
     """Main function for command-line usage."""
     import argparse
@@ -324,15 +511,16 @@ def main():
     parser.add_argument('-s', '--summary', action='store_true', help='Show analysis summary')
     parser.add_argument('--hierarchical', action='store_true', help='Show hierarchical vouchers')
     parser.add_argument('--limit', type=int, default=5, help='Limit number of hierarchical vouchers to show')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes analyzing vouchers')
     
     args = parser.parse_args()
     
     try:
         # Initialize analyzer
         analyzer = HierarchicalXMLAnalyzer(args.xml_file)
+        analyzer.workers = args.workers
         
-        # Load and analyze
-        analyzer.load_xml_content()
+        # Analyze; the file is streamed (or memory-mapped for malformed XML), never loaded whole
         results = analyzer.analyze_structure()
         
         # Show summary if requested
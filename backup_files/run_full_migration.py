@@ -4,52 +4,70 @@ Run Full Migration in Small Batches
 Automated script to migrate all data in small batches to avoid connection timeouts
 """
 
+import contextlib
+import sqlite3
 import subprocess
 import time
 import logging
 
+from batch_migration import batch_starts
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
-def run_batch_command(action, offset, limit):
+# SQLite database read by batch_migration.py, and the table behind each --action
+SQLITE_DB = 'tally_data.db'
+ACTION_TABLES = {
+    'vouchers': 'vouchers',
+    'ledgers': 'ledger_entries',
+    'inventory': 'inventory_entries',
+}
+
+def get_batch_starts(table_name, batch_size):
+    """Return the row count and the rowid each batch starts after (batch_migration.py pages by rowid)."""
+    table = ACTION_TABLES[table_name]
+    with contextlib.closing(sqlite3.connect(SQLITE_DB)) as conn:
+        total_count = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        return total_count, batch_starts(conn, table, batch_size)
+
+def run_batch_command(action, after_rowid, limit):
     """Run a batch migration command."""
     cmd = [
         'python3', 'batch_migration.py',
         '--action', action,
-        '--offset', str(offset),
+        '--after-rowid', str(after_rowid),
         '--limit', str(limit)
     ]
     
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)  # 5 minute timeout
         if result.returncode == 0:
-            logger.info(f"✅ {action} batch {offset}-{offset+limit} completed successfully")
+            logger.info(f"✅ {action} batch after rowid {after_rowid} completed successfully")
             return True
         else:
-            logger.error(f"❌ {action} batch {offset}-{offset+limit} failed: {result.stderr}")
+            logger.error(f"❌ {action} batch after rowid {after_rowid} failed: {result.stderr}")
             return False
     except subprocess.TimeoutExpired:
-        logger.error(f"⏰ {action} batch {offset}-{offset+limit} timed out")
+        logger.error(f"⏰ {action} batch after rowid {after_rowid} timed out")
         return False
     except Exception as e:
-        logger.error(f"❌ Error running {action} batch {offset}-{offset+limit}: {e}")
+        logger.error(f"❌ Error running {action} batch after rowid {after_rowid}: {e}")
         return False
 
-def migrate_table_in_batches(table_name, total_count, batch_size=50):
+def migrate_table_in_batches(table_name, batch_size=50):
     """Migrate a table in small batches."""
+    total_count, batch_starts = get_batch_starts(table_name, batch_size)
     logger.info(f"🚀 Starting {table_name} migration ({total_count} records)")
     
     success_count = 0
     error_count = 0
+    total_batches = len(batch_starts)
     
-    for offset in range(0, total_count, batch_size):
-        batch_num = offset // batch_size + 1
-        total_batches = (total_count + batch_size - 1) // batch_size
+    for batch_num, after_rowid in enumerate(batch_starts, 1):
+        logger.info(f"📦 Processing {table_name} batch {batch_num}/{total_batches} (after rowid: {after_rowid})")
         
-        logger.info(f"📦 Processing {table_name} batch {batch_num}/{total_batches} (offset: {offset})")
-        
-        if run_batch_command(table_name, offset, batch_size):
+        if run_batch_command(table_name, after_rowid, batch_size):
             success_count += 1
         else:
             error_count += 1
@@ -64,27 +82,22 @@ def main():
     """Run the full migration in small batches."""
     logger.info("🚀 Starting full migration in small batches...")
     
-    # Define the total counts (we know these from our SQLite database)
-    voucher_count = 1733
-    ledger_count = 1734
-    inventory_count = 1734
-    
     batch_size = 50  # Small batch size to avoid timeouts
     
     # Migrate vouchers
-    voucher_success, voucher_errors = migrate_table_in_batches('vouchers', voucher_count, batch_size)
+    voucher_success, voucher_errors = migrate_table_in_batches('vouchers', batch_size)
     
     # Small delay between tables
     time.sleep(5)
     
     # Migrate ledger entries
-    ledger_success, ledger_errors = migrate_table_in_batches('ledgers', ledger_count, batch_size)
+    ledger_success, ledger_errors = migrate_table_in_batches('ledgers', batch_size)
     
     # Small delay between tables
     time.sleep(5)
     
     # Migrate inventory entries
-    inventory_success, inventory_errors = migrate_table_in_batches('inventory', inventory_count, batch_size)
+    inventory_success, inventory_errors = migrate_table_in_batches('inventory', batch_size)
     
     # Summary
     total_success = voucher_success + ledger_success + inventory_success
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Streaming XML helpers for Tally exports
+Shared by the analyzers and migrations that walk ElementTree parse events.
+"""
+
+import xml.etree.ElementTree as ET
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+def iter_elements(
+    events: Iterable[Tuple[str, ET.Element]], leaves_only: bool = False
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yield (tag, text) for each element of a ('start', 'end') event stream, in document order.
+
+    `events` comes from ET.iterparse(..., events=('start', 'end')) or XMLPullParser.read_events().
+    Each element is detached from its parent once yielded, so memory stays bounded however
+    large the export is. With `leaves_only`, elements that have children are not yielded.
+    """
+    parents = []
+    has_children = []
+
+    for event, elem in events:
+        if event == 'start':
+            if has_children:
+                has_children[-1] = True
+            parents.append(elem)
+            has_children.append(False)
+            continue
+
+        parents.pop()
+        if not has_children.pop() or not leaves_only:
+            yield elem.tag, elem.text
+
+        # The parser reads ahead, so later siblings may already be attached to the parent.
+        # Every earlier sibling was detached at its own end event, though, so elem is
+        # always the parent's first remaining child.
+        if parents:
+            del parents[-1][0]